@@ -0,0 +1,110 @@
+"""Synthetic sales histories for benchmarks.
+
+Generates Company / Sale Date / Item / Qty rows at any scale and renders them
+in every upload format accepted by /upload_dotnet_data.
+
+    python benchmarks/generate_data.py --rows 1000000 --format csv --out sales.csv
+"""
+import argparse
+import io
+import json
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+# Upload formats in the order /upload_dotnet_data checks them
+UPLOAD_FORMATS = ['xlsx', 'csv', 'xml', 'json', 'sql', 'txt']
+
+# Rows per INSERT statement in generated SQL dumps
+SQL_ROWS_PER_INSERT = 1000
+
+def generate_sales(rows, companies=50, items=500, days=730, start='2022-01-01', seed=0):
+    """Sales rows with skewed company/item popularity, weekday seasonality and a slow upward trend"""
+    rng = np.random.default_rng(seed)
+    company_names = np.array([f"Company {i:04d}" for i in range(companies)], dtype=object)
+    item_names = np.array([f"ITEM{i:05d}" for i in range(items)], dtype=object)
+
+    # A few large customers and best-selling items, then a long tail
+    company_weights = 1 / np.arange(1, companies + 1) ** 0.8
+    item_weights = 1 / np.arange(1, items + 1) ** 1.1
+    company_idx = rng.choice(companies, rows, p=company_weights / company_weights.sum())
+    item_idx = rng.choice(items, rows, p=item_weights / item_weights.sum())
+    day = rng.integers(0, days, rows)
+    dates = pd.Timestamp(start) + pd.to_timedelta(day, unit='D')
+
+    item_scale = rng.uniform(5, 200, items)
+    weekday_boost = np.where(dates.dayofweek < 5, 1.3, 0.7)
+    trend = 1 + 0.5 * day / max(days, 1)
+    qty = rng.poisson(item_scale[item_idx] * weekday_boost * trend) + 1
+
+    df = pd.DataFrame({
+        'Company': company_names[company_idx],
+        'Sale Date': dates,
+        'Item': item_names[item_idx],
+        'Qty': qty
+    })
+    return df.sort_values('Sale Date', kind='stable').reset_index(drop=True)
+
+def to_upload_frame(df):
+    """Sales rows laid out like a .NET export: Company Name / Date (DD-MM-YYYY) / Item / Quantity"""
+    return pd.DataFrame({
+        'Company Name': df['Company'],
+        'Date': df['Sale Date'].dt.strftime('%d-%m-%Y'),
+        'Item': df['Item'],
+        'Quantity': df['Qty']
+    })
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+def to_upload_bytes(df, fmt):
+    """Render sales rows as the bytes of an upload file in the given format"""
+    upload = to_upload_frame(df)
+    if fmt == 'xlsx':
+        buffer = io.BytesIO()
+        upload.to_excel(buffer, index=False)
+        return buffer.getvalue()
+    if fmt == 'csv':
+        return upload.to_csv(index=False).encode('utf-8')
+    if fmt == 'txt':
+        return upload.to_csv(index=False, sep='\t').encode('utf-8')
+    if fmt == 'json':
+        return json.dumps(upload.to_dict('records')).encode('utf-8')
+    if fmt == 'xml':
+        columns = [col.replace(' ', '') for col in upload.columns]
+        parts = ['<?xml version="1.0" encoding="utf-8"?>\n<Sales>\n']
+        for row in upload.itertuples(index=False, name=None):
+            fields = ''.join(f'<{col}>{escape(str(value))}</{col}>' for col, value in zip(columns, row))
+            parts.append(f'  <Sale>{fields}</Sale>\n')
+        parts.append('</Sales>\n')
+        return ''.join(parts).encode('utf-8')
+    if fmt == 'sql':
+        columns = ', '.join(f'`{col}`' for col in upload.columns)
+        rows = [f"({', '.join(_sql_literal(value) for value in row)})"
+                for row in upload.astype(object).itertuples(index=False, name=None)]
+        statements = [f"INSERT INTO sales ({columns}) VALUES\n" + ',\n'.join(rows[i:i + SQL_ROWS_PER_INSERT]) + ';\n'
+                      for i in range(0, len(rows), SQL_ROWS_PER_INSERT)]
+        return ''.join(statements).encode('utf-8')
+    raise ValueError(f"Unknown upload format '{fmt}'. Available: {UPLOAD_FORMATS}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic sales history')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--companies', type=int, default=50)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=UPLOAD_FORMATS, default='csv')
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    df = generate_sales(args.rows, args.companies, args.items, args.days, seed=args.seed)
+    with open(args.out, 'wb') as f:
+        f.write(to_upload_bytes(df, args.format))
+    print(f"Wrote {len(df)} rows to {args.out}")
+
+if __name__ == '__main__':
+    main()
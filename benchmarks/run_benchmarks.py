@@ -0,0 +1,254 @@
+"""Benchmark the app's hot paths against a synthetic sales history.
+
+Runs every stage in a scratch data directory (through the PREDICTION_*_DIR
+environment overrides), so the real store and models are never touched:
+
+    python benchmarks/run_benchmarks.py --rows 100000
+    python benchmarks/run_benchmarks.py --rows 100000 --save-baseline main
+    python benchmarks/run_benchmarks.py --rows 100000 --compare main
+
+Each benchmark reports latency percentiles, throughput and the peak traced
+memory of one extra run under tracemalloc. --compare exits non-zero when a
+benchmark's median is slower than the saved baseline by more than --threshold.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from generate_data import generate_sales, to_upload_bytes, UPLOAD_FORMATS
+
+BASELINE_DIR = os.path.join(HERE, 'baselines')
+
+def measure(fn, repeat=5, items=1, setup=None, memory=True):
+    """Time fn(i) for i in range(repeat) and summarize.
+
+    items is the amount of work one call does (rows, queries, ...) and is used
+    for throughput. setup() runs untimed before every call. The peak memory
+    comes from one more call under tracemalloc, outside the timed runs.
+    """
+    times = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            fn(0)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    ms = np.array(times) * 1000
+    return {
+        'runs': repeat,
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+        'throughput_per_s': float(items * 1000 / ms.mean()) if ms.mean() > 0 else None,
+        'peak_mb': peak_mb
+    }
+
+def run(args):
+    results = {}
+
+    def record(name, stats):
+        results[name] = stats
+        peak = f"{stats['peak_mb']:.1f}" if stats['peak_mb'] is not None else '-'
+        print(f"{name:<40} p50 {stats['p50_ms']:>10.2f} ms  p95 {stats['p95_ms']:>10.2f} ms  "
+              f"{stats['throughput_per_s']:>12.1f}/s  peak {peak:>8} MB", flush=True)
+
+    print(f"Generating {args.rows} rows ({args.companies} companies, {args.items} items, {args.days} days)")
+    sales = generate_sales(args.rows, args.companies, args.items, args.days, seed=args.seed)
+
+    # Point the app at a scratch directory before it is imported
+    workdir = tempfile.mkdtemp(prefix='salespredict-bench-')
+    for env, sub in [('PREDICTION_EXCEL_DIR', 'excels'), ('PREDICTION_UPLOAD_DIR', 'upload'),
+                     ('PREDICTION_MODEL_DIR', 'models')]:
+        os.environ[env] = os.path.join(workdir, sub)
+    # Per-request logging is DEBUG and already off; also keep upload/training INFO lines out of the report
+    os.environ.setdefault('PREDICTION_LOG_LEVEL', 'WARNING')
+    import data_processing as dp
+    import main as app_main
+    client = app_main.app.test_client()
+
+    try:
+        # Upload paths, without the background training each upload would start
+        app_main.submit_training = lambda: None
+        upload_rows = sales.sample(n=min(args.upload_rows, len(sales)), random_state=args.seed)
+        for fmt in args.formats:
+            payload = to_upload_bytes(upload_rows, fmt)
+
+            def upload(i, payload=payload, fmt=fmt):
+                response = client.post('/upload_dotnet_data', data={'file': (io.BytesIO(payload), f'sales.{fmt}')},
+                                       content_type='multipart/form-data')
+                assert response.status_code == 202, response.get_json()
+            record(f'upload.{fmt}', measure(upload, repeat=args.upload_repeat, items=len(upload_rows)))
+
+        # .NET clients also post the rows as a JSON body, or as a JSON string in form data
+        records = json.loads(to_upload_bytes(upload_rows, 'json'))
+
+        def upload_json(i):
+            response = client.post('/upload_dotnet_data', json=records)
+            assert response.status_code == 202, response.get_json()
+        record('upload.json_body', measure(upload_json, repeat=args.upload_repeat, items=len(upload_rows)))
+        form_payload = json.dumps(records)
+
+        def upload_form(i):
+            response = client.post('/upload_dotnet_data', data={form_payload: ''})
+            assert response.status_code == 202, response.get_json()
+        record('upload.form', measure(upload_form, repeat=args.upload_repeat, items=len(upload_rows)))
+
+        record('store.replace', measure(lambda i: dp.save_sales_data(sales), repeat=1, items=len(sales)))
+
+        # Appends merge into the full history, so each run starts from it again
+        csv_payload = to_upload_bytes(upload_rows, 'csv')
+
+        def upload_append(i):
+            response = client.post('/upload_dotnet_data?mode=append',
+                                   data={'file': (io.BytesIO(csv_payload), 'sales.csv')},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 202, response.get_json()
+        record('upload.csv.append', measure(upload_append, repeat=args.upload_repeat, items=len(upload_rows),
+                                            setup=lambda: dp.save_sales_data(sales)))
+        dp.save_sales_data(sales)
+        record('load_excel_data.cold', measure(lambda i: dp.load_excel_data(), repeat=3, items=len(sales),
+                                               setup=dp.bump_data_version))
+        record('load_excel_data.warm', measure(lambda i: dp.load_excel_data(), repeat=10, items=len(sales)))
+
+        def clear_models():
+            shutil.rmtree(dp.MODEL_DIR, ignore_errors=True)
+        record('preprocess_data.fast', measure(lambda i: dp.preprocess_data('fast'), repeat=1, items=len(sales),
+                                               setup=clear_models, memory=not args.skip_training_memory))
+        record('preprocess_data', measure(lambda i: dp.preprocess_data('full'), repeat=1, items=len(sales),
+                                          setup=clear_models, memory=not args.skip_training_memory))
+        record('preprocess_data.saved_model', measure(lambda i: dp.preprocess_data('full'), repeat=1, items=len(sales)))
+
+        rng = np.random.default_rng(args.seed)
+        companies = sales['Company'].unique()
+        first, last = sales['Sale Date'].min(), sales['Sale Date'].max()
+        span = (last - first).days
+        queries = []
+        for _ in range(args.queries):
+            start = first + np.timedelta64(int(rng.integers(0, span)), 'D')
+            end = start + np.timedelta64(int(rng.integers(1, 120)), 'D')
+            queries.append({'company': str(rng.choice(companies)),
+                            'from_date': start.strftime('%Y-%m-%d'), 'to_date': end.strftime('%Y-%m-%d')})
+        record('get_total_quantity', measure(
+            lambda i: dp.get_total_quantity(**queries[i]), repeat=len(queries)))
+        record('get_total_quantities', measure(
+            lambda i: dp.get_total_quantities(queries), repeat=3, items=len(queries)))
+        record('http.get_quantity', measure(
+            lambda i: client.get('/get_quantity', query_string=queries[i]), repeat=len(queries)))
+
+        company = sales['Company'].value_counts().index[0]
+        horizon_start = (last + np.timedelta64(1, 'D')).strftime('%Y-%m-%d')
+        horizon_end = (last + np.timedelta64(args.horizon, 'D')).strftime('%Y-%m-%d')
+        for frequency in ['Daily', 'Weekly', 'Monthly']:
+            def forecast(i, frequency=frequency):
+                result = dp.forecast_quantity(company, horizon_start, horizon_end, frequency)
+                assert not isinstance(result, str), result
+            record(f'forecast_quantity.{frequency}.cold', measure(
+                forecast, repeat=args.forecast_repeat, setup=dp.clear_forecast_cache))
+            record(f'forecast_quantity.{frequency}.cached', measure(forecast, repeat=args.forecast_repeat))
+        record('forecast_companies.all.Weekly', measure(
+            lambda i: dp.forecast_companies('all', horizon_start, horizon_end, 'Weekly'),
+            repeat=1, items=len(companies), setup=dp.clear_forecast_cache))
+        record('http.forecast.Weekly', measure(
+            lambda i: client.post('/forecast?export=none', json={
+                'company': company, 'from_date': horizon_start, 'to_date': horizon_end, 'frequency': 'Weekly'}),
+            repeat=args.forecast_repeat))
+    finally:
+        dp.flush_fetch_log()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+def compare(results, baseline, threshold):
+    """Print the median change against a baseline; returns the names that regressed"""
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline p50':>14} {'p50':>12} {'change':>9}")
+    for name, stats in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<40} {'-':>14} {stats['p50_ms']:>10.2f}ms {'new':>9}")
+            continue
+        change = stats['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] else 0.0
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{name:<40} {base['p50_ms']:>12.2f}ms {stats['p50_ms']:>10.2f}ms {change:>+8.1%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sales prediction app on synthetic data')
+    parser.add_argument('--rows', type=int, default=100000, help='synthetic history size (10k to 10M)')
+    parser.add_argument('--companies', type=int, default=50)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--upload-rows', type=int, default=10000, help='rows per upload benchmark')
+    parser.add_argument('--upload-repeat', type=int, default=3)
+    parser.add_argument('--formats', nargs='+', choices=UPLOAD_FORMATS, default=UPLOAD_FORMATS)
+    parser.add_argument('--queries', type=int, default=500, help='quantity queries to time')
+    parser.add_argument('--horizon', type=int, default=90, help='forecast horizon in days')
+    parser.add_argument('--forecast-repeat', type=int, default=3)
+    parser.add_argument('--skip-training-memory', action='store_true',
+                        help='do not train a second time under tracemalloc')
+    parser.add_argument('--output', metavar='PATH', help='write the results as JSON')
+    parser.add_argument('--save-baseline', metavar='NAME', help='save results as benchmarks/baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare against benchmarks/baselines/NAME.json')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed median slowdown for --compare')
+    args = parser.parse_args()
+
+    results = run(args)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args)
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        baseline_path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {regressions}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
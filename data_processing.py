@@ -1,406 +1,1755 @@
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import cross_val_score
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.base import clone
 import os
+import io
 import re  # Add this import for the re.sub function
+import json
+import threading
+import time
+import atexit
+import hashlib
+import joblib
+import uuid
+import importlib.util
+from collections import OrderedDict
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from storage import open_store
+from name_index import NameIndex
+from snapshot import DataSnapshot
+from features import FEATURES, WINDOW, ZERO_SAMPLE_RATIO, DailyPanel, calendar_features, feature_matrix
+from forest import FlatForest
+from metrics import get_logger, timed, timed_iter
+
+log = get_logger('data_processing')
+
+# 'standalone' loads, trains and serves in this process. For multi-process serving one
+# 'trainer' (trainer.py) trains and publishes snapshots that 'worker' processes memory-map.
+SERVING_MODES = ['standalone', 'trainer', 'worker']
+SERVING_MODE = os.environ.get('PREDICTION_SERVING_MODE', 'standalone').lower()
+if SERVING_MODE not in SERVING_MODES:
+    raise ValueError(f"Unknown serving mode '{SERVING_MODE}'. Available: {SERVING_MODES}")
+# How often workers look for a newer published model, and the trainer for new data
+PUBLISH_POLL_SECONDS = 1.0
+TRAINER_POLL_SECONDS = 2.0
+
+# Published training result: a DataSnapshot of the trained frame, encoders, model and
+# lookups, replaced as a whole by _publish_model. Requests read it once and keep that reference.
+model_state = None
+_model_lock = threading.Lock()
+
+# Background training: a single worker so trainings never overlap
+MAX_TRAINING_JOBS = 100
+training_jobs = {}
+_training_jobs_lock = threading.Lock()
+_training_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='training')
+_latest_training_job = None
+
+# Daily forecast matrices keyed by (company, from_date, to_date, model version), least recently used first
+FORECAST_CACHE_MAX_ENTRIES = 128
+FORECAST_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_forecast_cache = OrderedDict()
+_forecast_cache_lock = threading.Lock()
+forecast_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+# Bulk forecasts split large simulations across worker processes that memory-map the model artifact;
+# serving workers are already one process per core, so they simulate in-process
+FORECAST_WORKERS = 1 if SERVING_MODE == 'worker' else min(4, os.cpu_count() or 1)
+FORECAST_POOL_MIN_SERIES = 5000
+_forecast_pool = None
+_forecast_pool_lock = threading.Lock()
+_worker_estimators = {}
+
+# Quantity results are queued and appended to the fetched-data log by a background writer.
+# _fetch_log_keys holds the queries logged up to byte _fetch_log_offset of the log plus the ones queued here
+FETCH_LOG_FLUSH_SECONDS = 1.0
+_fetch_log_keys = None
+_fetch_log_offset = 0
+_fetch_log_pending = []
+_fetch_log_flush_scheduled = False
+_fetch_log_lock = threading.Lock()
+_fetch_log_write_lock = threading.Lock()
+_fetch_log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fetch-log')
 
-# Global variables
-combined_df = None
-le_item = None
-le_company = None
-model = None
-company_mapping = None
+# Forecast exports are written by a background worker into per-request files; requests are
+# turned away while MAX_PENDING_FORECAST_EXPORTS are still waiting to be written
+MAX_FORECAST_EXPORTS = 50
+MAX_PENDING_FORECAST_EXPORTS = 8
+EXPORT_QUEUE_FULL = "Error: Too many forecast exports are pending, try again later"
+forecast_exports = {}
+_forecast_exports_lock = threading.Lock()
+_export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='forecast-export')
 
-# Define directories
-OUTPUT_DIR = r"M:\Project\Predication_model\excels"
-UPLOAD_DIR = r"M:\Project\Predication_model\upload"
+# Process-wide cache of the cleaned dataset: a DataSnapshot whose version is (data_version, store version),
+# with the quantity index, daily panel and row keys filled in lazily by swapping in a new snapshot
+data_version = 0
+_dataset_snapshot = None
+_dataset_lock = threading.Lock()
+
+# Accepted Sale Date formats, tried in this order
+DATE_FORMATS = ['%d-%m-%Y', '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y']
+# Month-first and day-first slash dates read the same strings differently, so a column uses only one
+SLASH_DATE_FORMATS = ['%m/%d/%Y', '%d/%m/%Y']
+
+MODEL_PARAMS = {
+    'n_estimators': 200,
+    'max_depth': 15,
+    'min_samples_split': 5,
+    'min_samples_leaf': 2,
+    'random_state': 42,
+    'n_jobs': -1
+}
+
+# Histogram gradient boosting trains in seconds where the forest takes minutes on large histories
+FAST_MODEL_PARAMS = {
+    'max_iter': 200,
+    'learning_rate': 0.1,
+    'max_leaf_nodes': 63,
+    'min_samples_leaf': 20,
+    'early_stopping': False,
+    'random_state': 42
+}
+
+# Training profiles: the estimator trained on the full history and how its error is measured.
+# 'full' validates over time-ordered expanding folds, 'fast' on the most recent share of rows;
+# either way validation runs alongside the final fit.
+TRAINING_PROFILES = {
+    'full': {'estimator': RandomForestRegressor, 'params': MODEL_PARAMS, 'validation': 'timeseries', 'splits': 5},
+    'fast': {'estimator': HistGradientBoostingRegressor, 'params': FAST_MODEL_PARAMS, 'validation': 'holdout', 'holdout': 0.2}
+}
+TRAINING_PROFILE = os.environ.get('PREDICTION_TRAINING_PROFILE', 'full').lower()
+if TRAINING_PROFILE not in TRAINING_PROFILES:
+    raise ValueError(f"Unknown training profile '{TRAINING_PROFILE}'. Available: {list(TRAINING_PROFILES)}")
+
+# Bump when the saved artifact layout changes so old artifacts are not reused
+ARTIFACT_FORMAT = 3
+MAX_MODEL_ARTIFACTS = 5
+
+# Define directories; each can be overridden through the environment
+OUTPUT_DIR = os.environ.get('PREDICTION_EXCEL_DIR', r"M:\Project\Predication_model\excels")
+UPLOAD_DIR = os.environ.get('PREDICTION_UPLOAD_DIR', r"M:\Project\Predication_model\upload")
+MODEL_DIR = os.environ.get('PREDICTION_MODEL_DIR', r"M:\Project\Predication_model\models")
+# The trainer points workers at the current model and snapshot here and reports its progress
+PUBLISHED_MODEL_PATH = os.path.join(MODEL_DIR, "current.json")
+TRAINER_STATUS_PATH = os.path.join(MODEL_DIR, "training.json")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def load_excel_data():
-    """Load data from Uploaded Data.xlsx with error handling"""
+# Sales history lives in the store; Uploaded Data.xlsx is only an import/export format
+STORE_BACKEND = 'sqlite'
+LEGACY_UPLOAD_PATH = os.path.join(UPLOAD_DIR, "Uploaded Data.xlsx")
+store = open_store(STORE_BACKEND, os.path.join(UPLOAD_DIR, "sales.db"))
+
+# Fetched quantities are logged to an append-only CSV; data_fetched.xlsx is an on-demand export
+FETCH_LOG_PATH = os.path.join(OUTPUT_DIR, "data_fetched.csv")
+LEGACY_FETCH_LOG_PATH = os.path.join(OUTPUT_DIR, "data_fetched.xlsx")
+FETCH_LOG_COLUMNS = ['Company Name', 'From Date', 'To Date', 'Total Quantity']
+# Held while reading or appending the log, which every serving process writes to
+FETCH_LOG_LOCK_PATH = f"{FETCH_LOG_PATH}.lock"
+
+# Forecast export files, one per request, in any of these formats
+EXPORT_DIR = os.path.join(OUTPUT_DIR, "forecasts")
+EXPORT_FORMATS = {
+    'csv': ('text/csv', lambda df, path: df.to_csv(path, index=False)),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', lambda df, path: df.to_excel(path, index=False)),
+    'parquet': ('application/vnd.apache.parquet', lambda df, path: df.to_parquet(path, index=False))
+}
+
+def clean_sales_data(df, date_formats=None):
+    """Normalize column names, company names, duplicates and Sale Date of a sales frame.
+
+    date_formats is a list shared by the chunks of one upload: formats an
+    earlier chunk matched are tried first, and it is updated with this
+    chunk's. It is never carried over to another upload, where the same
+    ambiguous date could mean something else.
+    """
+    df = df.copy()
+    # Normalize column names
+    df.columns = df.columns.str.strip().str.title()
+    log.debug("Loaded data with columns %s, shape %s", list(df.columns), df.shape)
+    # Clean company names by removing non-breaking spaces and extra whitespace
+    if 'Company' in df.columns:
+        df['Company'] = df['Company'].str.strip().replace(r'\s+', ' ', regex=True)
+    # Remove duplicates based on key columns
+    df = df.drop_duplicates(subset=['Company', 'Sale Date', 'Item', 'Qty'], keep='last')
+    log.debug("Data shape after removing duplicates: %s", df.shape)
+    # Parse dates once here so readers never re-parse them; bad dates stay NaT
+    if 'Sale Date' in df.columns:
+        with timed('date_parse'):
+            parsed, formats = parse_dates(df['Sale Date'], preferred=date_formats)
+        invalid = parsed.isnull()
+        if invalid.any():
+            log.warning("%d unparseable Sale Date values, first rows: %s",
+                        int(invalid.sum()), df.loc[invalid, 'Sale Date'].head(10).to_dict())
+        df['Sale Date'] = parsed
+        if formats and date_formats is not None:
+            date_formats[:] = formats + [fmt for fmt in date_formats if fmt not in formats]
+            log.debug("Sale Date formats detected: %s", formats)
+    return df
+
+def write_sales_data(chunks, mode='replace'):
+    """Clean and store an iterable of sales frames in a single store transaction.
+
+    mode 'replace' overwrites the stored history and 'append' merges the rows
+    into it. Each chunk is cleaned and written before the next one is pulled,
+    so memory stays bounded by the chunk size. Returns the number of rows received.
+    """
+    before = (data_version, store.version())
+    row_count = 0
+    # Formats matched by earlier chunks of this upload are tried first on the next
+    date_formats = []
+    with store.writer(mode) as writer:
+        for chunk in chunks:
+            row_count += len(chunk)
+            cleaned = clean_sales_data(chunk, date_formats)
+            with timed('store_write'):
+                writer.write(cleaned)
+    if mode == 'append':
+        _merge_appended_rows(before, store.read(after_id=writer.start_id))
+    else:
+        bump_data_version()
+    log.info("Data saved to %s (%s, %d rows)", store.path, mode, row_count)
+    return row_count
+
+def save_sales_data(df):
+    """Clean a sales frame and replace the stored history with it"""
+    return write_sales_data([df], 'replace')
+
+def append_sales_data(df):
+    """Clean new rows and merge them into the stored history.
+
+    Only the new rows are deduplicated, against the store's unique key index.
+    """
+    return write_sales_data([df], 'append')
+
+def _row_keys(df):
+    """Hash each row's (Company, Sale Date, Item, Qty) dedupe key"""
+    keys = df[['Company', 'Sale Date', 'Item', 'Qty']].copy()
+    keys['Qty'] = pd.to_numeric(keys['Qty'], errors='coerce').astype(float)
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def _merge_appended_rows(before, stored):
+    """Extend the dataset cache with appended rows instead of reloading it.
+
+    before is the cache version from just before the append; if the cache still
+    holds that version, a new snapshot is built from the cached frame, row keys,
+    prefix-sum index and daily panel extended with the stored rows. Otherwise
+    the cache is simply invalidated.
+    """
+    global data_version, _dataset_snapshot
+    with _dataset_lock:
+        cached = _dataset_snapshot
+        data_version += 1
+        if cached is None or cached.version != before:
+            _dataset_snapshot = None
+            return
+        row_keys = cached.row_keys
+        if row_keys is None:
+            row_keys = _row_keys(cached.df)
+        new_keys = _row_keys(stored)
+        # Rows re-sent with an existing key replace the cached row at the end
+        replaced = np.isin(row_keys, new_keys)
+        is_new = ~np.isin(new_keys, row_keys)
+        quantity_index, company_names = None, None
+        if cached.quantity_index is not None:
+            quantity_index = _merge_quantity_index(cached.quantity_index, stored[is_new])
+            company_names = NameIndex(quantity_index)
+        panel = None
+        if cached.panel is not None:
+            with timed('features'):
+                panel = cached.panel.extend(stored[is_new])
+        # Appends only extend the store dictionaries, so the stored rows' categories cover the cached ones
+        kept = cached.df[~replaced].copy()
+        for column in ['Company', 'Item']:
+            if isinstance(kept[column].dtype, pd.CategoricalDtype) and isinstance(stored[column].dtype, pd.CategoricalDtype):
+                kept[column] = kept[column].cat.set_categories(stored[column].cat.categories)
+        _dataset_snapshot = DataSnapshot(
+            version=(data_version, store.version()),
+            df=pd.concat([kept, stored], ignore_index=True).infer_objects(),
+            quantity_index=quantity_index,
+            company_names=company_names,
+            panel=panel,
+            row_keys=np.concatenate([row_keys[~replaced], new_keys])
+        )
+        log.info("Appended %d new rows, replaced %d existing rows", int(is_new.sum()), int(replaced.sum()))
+
+def import_excel_data(file_path=LEGACY_UPLOAD_PATH):
+    """Import an Excel sales history into the store, replacing its contents"""
+    log.info("Importing data from %s", file_path)
+    with timed('file_read'):
+        df = pd.read_excel(file_path)
+    return save_sales_data(df)
+
+def export_excel_data(file_path):
+    """Write the stored history to an Excel file with DD-MM-YYYY dates"""
+    df = load_excel_data()
+    if 'Sale Date' in df.columns:
+        df['Sale Date'] = df['Sale Date'].dt.strftime('%d-%m-%Y')
+    with timed('excel_write'):
+        df.to_excel(file_path, index=False)
+    log.info("Data exported to %s", file_path)
+    return file_path
+
+def bump_data_version():
+    """Invalidate the cached dataset after the stored history has been replaced"""
+    global data_version, _dataset_snapshot
+    with _dataset_lock:
+        data_version += 1
+        _dataset_snapshot = None
+
+def _empty_dataset():
+    return DataSnapshot(version=None, df=pd.DataFrame(columns=['Sale Date', 'Item', 'Qty', 'Company']),
+                        quantity_index={}, company_names=NameIndex([]), panel=None, row_keys=None)
+
+def _current_dataset():
+    """Return the DataSnapshot of the stored history, loading it when the store changed"""
     try:
-        file_path = os.path.join(UPLOAD_DIR, "Uploaded Data.xlsx")
-        if os.path.exists(file_path):
-            print(f"Loading data from {file_path}")
-            df = pd.read_excel(file_path)
-            # Normalize column names
-            df.columns = df.columns.str.strip().str.title()
-            print(f"Loaded data with columns: {list(df.columns)}")
-            print(f"Data shape: {df.shape}")
-            # Clean company names by removing non-breaking spaces and extra whitespace
-            if 'Company' in df.columns:
-                df['Company'] = df['Company'].str.strip().replace(r'\s+', ' ', regex=True)
-                print(f"Company values after cleaning: {df['Company'].unique()}")
-            # Remove duplicates based on key columns
-            df = df.drop_duplicates(subset=['Company', 'Sale Date', 'Item', 'Qty'], keep='last')
-            print(f"Data shape after removing duplicates: {df.shape}")
-            return df
-        else:
-            print(f"Warning: File not found at {file_path}")
-            return pd.DataFrame(columns=['Sale Date', 'Item', 'Qty', 'Company'])
+        if not store.exists():
+            if os.path.exists(LEGACY_UPLOAD_PATH):
+                # One-time migration of the Excel history into the store
+                import_excel_data(LEGACY_UPLOAD_PATH)
+            else:
+                log.warning("No stored data found at %s", store.path)
+                return _empty_dataset()
+        key = (data_version, store.version())
+        snapshot = _dataset_snapshot
+        if snapshot is not None and snapshot.version == key:
+            return snapshot
+        log.info("Loading data from %s", store.path)
+        with timed('store_read'):
+            df = store.read()
+        log.info("Loaded %d rows", len(df))
+        snapshot = DataSnapshot(version=key, df=df, quantity_index=None, company_names=None, panel=None, row_keys=None)
+        _swap_dataset(None, snapshot)
+        return snapshot
     except Exception as e:
-        print(f"Error loading Excel data: {str(e)}")
-        return pd.DataFrame(columns=['Sale Date', 'Item', 'Qty', 'Company'])
+        log.error("Error loading stored data: %s", e)
+        return _empty_dataset()
 
-def parse_date(date):
-    """Parse date with multiple format attempts"""
-    for fmt in ['%d-%m-%Y', '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y']:
-        try:
-            return pd.to_datetime(date, format=fmt, errors='coerce')
-        except:
-            continue
-    return pd.NaT
+def _swap_dataset(expected, snapshot):
+    """Publish a dataset snapshot unless the data changed since expected (None: since snapshot's version)"""
+    global _dataset_snapshot
+    with _dataset_lock:
+        if expected is not None and _dataset_snapshot is not expected:
+            return
+        # Only publish if no upload bumped the version while it was being built
+        if snapshot.version[0] == data_version:
+            _dataset_snapshot = snapshot
 
-def preprocess_data():
-    global combined_df, le_company, le_item, model, company_mapping
-    
-    # Reload the data to ensure we have the latest
+def _cached_dataset():
+    """Return the shared cleaned dataset; callers must not mutate it"""
+    return _current_dataset().df
+
+def load_excel_data(columns=None, company=None, from_date=None, to_date=None):
+    """Load the sales history, served from memory until the stored data changes.
+
+    Without arguments the full cleaned frame comes from the in-memory cache.
+    A column projection or a company/date filter is pushed down to the store.
+    """
+    if columns is None and company is None and from_date is None and to_date is None:
+        return _cached_dataset().copy()
     try:
-        combined_df = load_excel_data()
+        if not store.exists():
+            return pd.DataFrame(columns=columns or ['Sale Date', 'Item', 'Qty', 'Company'])
+        with timed('filter'):
+            return store.read(columns, company=company, from_date=from_date, to_date=to_date)
     except Exception as e:
-        print(f"Error reloading data during preprocessing: {str(e)}")
+        log.error("Error loading stored data: %s", e)
+        return pd.DataFrame(columns=columns or ['Sale Date', 'Item', 'Qty', 'Company'])
+
+def normalize_company(name):
+    """Normalize a company name for case- and whitespace-insensitive matching"""
+    name = re.sub(r'\s+', ' ', str(name).replace('\xa0', ' ').strip())
+    return name.lower().strip()
+
+def _build_quantity_index(df):
+    """Build per-company Sale Date arrays with a cumulative Qty array for range totals.
+
+    Maps each normalized company name to (sorted dates, cumulative qty) where
+    cumulative qty has a leading 0, so the total between two positions is a
+    single subtraction. Companies keep their order of first appearance.
+    """
+    index = {}
+    if df.empty or 'Company' not in df.columns or 'Sale Date' not in df.columns:
+        return index
+    valid = df.dropna(subset=['Sale Date'])
+    # Normalize each category once; a missing Company (code -1) is keyed as 'nan'
+    companies = valid['Company'].astype('category')
+    names = companies.cat.categories.astype(str).tolist() + ['nan']
+    key_codes, keys = pd.factorize(np.array([normalize_company(name) for name in names], dtype=object))
+    row_keys = key_codes[companies.cat.codes.to_numpy()]
+    for code, group in valid.groupby(row_keys, sort=False):
+        key = keys[code]
+        group = group.sort_values('Sale Date', kind='stable')
+        dates = group['Sale Date'].to_numpy(dtype='datetime64[ns]')
+        qty = pd.to_numeric(group['Qty'], errors='coerce')
+        # Keep integer quantities exact; fall back to float for fractional ones
+        qty = qty.to_numpy(dtype=np.int64) if pd.api.types.is_integer_dtype(qty) else qty.fillna(0).to_numpy(dtype=float)
+        index[key] = (dates, np.concatenate(([0], np.cumsum(qty))))
+    return index
+
+def _merge_quantity_index(index, rows):
+    """Return a copy of a prefix-sum index with new rows merged into their companies"""
+    index = dict(index)
+    for key, (new_dates, new_cum) in _build_quantity_index(rows).items():
+        if key in index:
+            dates, cum = index[key]
+            all_dates = np.concatenate([dates, new_dates])
+            qty = np.concatenate([np.diff(cum), np.diff(new_cum)])
+            order = np.argsort(all_dates, kind='stable')
+            index[key] = (all_dates[order], np.concatenate(([0], np.cumsum(qty[order]))))
+        else:
+            index[key] = (new_dates, new_cum)
+    return index
+
+def get_quantity_index():
+    """Return the cached dataset, its company prefix-sum index and a NameIndex over the index keys.
+
+    All three come from one dataset snapshot and are built once per data
+    version; company names resolve to index keys through the NameIndex
+    instead of scanning the index.
+    """
+    if SERVING_MODE == 'worker':
+        # Workers answer from the trainer's published snapshot instead of loading the history
+        sync_published_model()
+        state = model_state
+        if state is None:
+            snapshot = _empty_dataset()
+            return snapshot.df, snapshot.quantity_index, snapshot.company_names
+        return state['combined_df'], state['quantity_index'], state['company_names']
+    snapshot = _with_quantity_index(_current_dataset())
+    return snapshot.df, snapshot.quantity_index, snapshot.company_names
+
+def _with_quantity_index(snapshot):
+    """The dataset snapshot with its prefix-sum index and company NameIndex, built once per data version"""
+    if snapshot.quantity_index is None:
+        index = _build_quantity_index(snapshot.df)
+        indexed = snapshot.replace(quantity_index=index, company_names=NameIndex(index))
+        _swap_dataset(snapshot, indexed)
+        snapshot = indexed
+    return snapshot
+
+def _training_dataset():
+    """The current dataset snapshot with its company index and DailyPanel, built once per data version
+    and extended on append"""
+    snapshot = _with_quantity_index(_current_dataset())
+    if snapshot.panel is None and snapshot.version is not None:
+        with timed('features'):
+            panel = DailyPanel.from_rows(snapshot.df)
+        with_panel = snapshot.replace(panel=panel)
+        _swap_dataset(snapshot, with_panel)
+        snapshot = with_panel
+    return snapshot
+
+def _range_total(entry, from_date, to_date):
+    """Total Qty between two dates (inclusive) using two binary searches; 0 for a reversed range"""
+    dates, cum_qty = entry
+    start = np.searchsorted(dates, np.datetime64(from_date, 'ns'), side='left')
+    end = np.searchsorted(dates, np.datetime64(to_date, 'ns'), side='right')
+    return cum_qty[end] - cum_qty[start] if end > start else 0
+
+def parse_dates(values, preferred=None, infer=False):
+    """Parse a column of dates, trying each format over all still-unparsed rows at once.
+
+    Formats in preferred (such as those an earlier parse of the same upload
+    matched) are tried before the rest of DATE_FORMATS. Of SLASH_DATE_FORMATS
+    the column uses the first that parses every slash date, and a preferred
+    one is kept; when none does, those rows stay NaT. With infer=True, rows no
+    format matched get a final pass through pandas' own date inference.
+    Returns the parsed Series (NaT where nothing matched) and the list of
+    formats that matched at least one row.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, []
+    raw = values.to_numpy(dtype=object)
+    parsed = np.full(len(raw), np.datetime64('NaT'), dtype='datetime64[ns]')
+    pending = np.flatnonzero(values.notna().to_numpy())
+    preferred = list(preferred or [])
+    formats = preferred + [fmt for fmt in DATE_FORMATS if fmt not in preferred]
+    matched = []
+    for fmt in formats:
+        if len(pending) == 0:
+            break
+        if fmt in SLASH_DATE_FORMATS:
+            continue
+        attempt = pd.to_datetime(raw[pending], format=fmt, errors='coerce')
+        ok = ~attempt.isna()
+        if ok.any():
+            parsed[pending[ok]] = attempt[ok].to_numpy(dtype='datetime64[ns]')
+            pending = pending[~ok]
+            matched.append(fmt)
+    slash_formats = [fmt for fmt in formats if fmt in SLASH_DATE_FORMATS]
+    allowed = [fmt for fmt in slash_formats if fmt in preferred] or slash_formats
+    if len(pending):
+        attempts = [pd.to_datetime(raw[pending], format=fmt, errors='coerce') for fmt in slash_formats]
+        ok = [~attempt.isna() for attempt in attempts]
+        slash = np.logical_or.reduce(ok)
+        if slash.any():
+            fits = [i for i, fmt in enumerate(slash_formats) if fmt in allowed and ok[i][slash].all()]
+            if fits:
+                parsed[pending[slash]] = attempts[fits[0]][slash].to_numpy(dtype='datetime64[ns]')
+                matched.append(slash_formats[fits[0]])
+            else:
+                log.warning("Sale Date mixes month-first and day-first dates, %d rows left unparsed", int(slash.sum()))
+            # Inference would read the rejected rows with mixed conventions too
+            pending = pending[~slash]
+    if infer and len(pending):
+        attempt = pd.to_datetime(pd.Series(raw[pending]), errors='coerce')
+        ok = attempt.notna().to_numpy()
+        parsed[pending[ok]] = attempt[ok].to_numpy(dtype='datetime64[ns]')
+    return pd.Series(parsed, index=values.index, name=values.name), matched
+
+def parse_date(date):
+    """Parse a single date with multiple format attempts"""
+    return parse_dates([date])[0].iloc[0]
+
+def preprocess_data(profile=None):
+    """Train a model on the stored history and publish it.
+
+    profile names one of TRAINING_PROFILES and defaults to TRAINING_PROFILE.
+    Everything is built in local variables and swapped in at the end, so
+    forecasts keep using the previous model until training has finished.
+    Returns the new model version, or an "Error: ..." string.
+    """
+    profile = profile or TRAINING_PROFILE
+    if profile not in TRAINING_PROFILES:
+        return f"Error: Unknown training profile '{profile}'. Available: {list(TRAINING_PROFILES)}"
+    # The latest stored data, its daily panel and company index, from one dataset snapshot
+    dataset = _training_dataset()
+    combined_df, panel = dataset.df, dataset.panel
     
     if combined_df.empty:
-        print("No data available for preprocessing")
-        return
+        log.warning("No data available for preprocessing")
+        return "Error: No data available for preprocessing"
     
     # Check if required columns exist
     required_columns = ['Sale Date', 'Item', 'Qty', 'Company']
     missing_columns = [col for col in required_columns if col not in combined_df.columns]
     if missing_columns:
-        print(f"Error: Missing columns in data: {missing_columns}")
-        print(f"Available columns: {list(combined_df.columns)}")
-        return
+        log.error("Missing columns in data: %s (available: %s)", missing_columns, list(combined_df.columns))
+        return f"Error: Missing columns in data: {missing_columns}"
 
     # Validate data types
     if not pd.to_numeric(combined_df['Qty'], errors='coerce').notnull().all():
-        print("Error: Qty column contains non-numeric values")
-        return
+        log.error("Qty column contains non-numeric values")
+        return "Error: Qty column contains non-numeric values"
     
-    # Convert Sale Date to datetime with multiple format attempts
+    # Sale Date is parsed before it is stored; rows that could not be parsed are NaT
     try:
-        combined_df['Sale Date'] = combined_df['Sale Date'].apply(parse_date)
         if combined_df['Sale Date'].isnull().any():
             invalid_dates = combined_df[combined_df['Sale Date'].isnull()]['Sale Date'].index.tolist()
             invalid_data = combined_df.loc[invalid_dates, ['Sale Date']].to_dict()
-            print(f"Error: Invalid Sale Date values at rows: {invalid_dates}")
-            print(f"Invalid Sale Date data: {invalid_data}")
-            return
+            log.error("Invalid Sale Date values at rows: %s (%s)", invalid_dates, invalid_data)
+            return f"Error: Invalid Sale Date values at rows: {invalid_dates}"
     except Exception as e:
-        print(f"Error parsing Sale Date: {str(e)}")
-        return
+        log.error("Error parsing Sale Date: %s", e)
+        return f"Error parsing Sale Date: {str(e)}"
+
+    # Identical data trains an identical model, so reuse a saved one when available
+    fingerprint = data_fingerprint(combined_df, profile)
+    artifact = load_model_artifact(fingerprint)
 
     # Store clean company names for comparison later
     company_mapping = combined_df['Company'].unique().tolist()
-    print(f"Found companies: {company_mapping}")
-
-    combined_df['Month'] = combined_df['Sale Date'].dt.month
-    combined_df['Day'] = combined_df['Sale Date'].dt.day
-    combined_df['Year'] = combined_df['Sale Date'].dt.year
-    combined_df['DayOfWeek'] = combined_df['Sale Date'].dt.dayofweek
-    combined_df['Quarter'] = combined_df['Sale Date'].dt.quarter
+    log.info("Found %d companies", len(company_mapping))
 
+    # Rows in date order; forecasts list items in the order of their first sale
     combined_df = combined_df.sort_values('Sale Date')
-    combined_df['Lag1'] = combined_df.groupby(['Item', 'Company'])['Qty'].shift(1).fillna(0)
-    combined_df['Lag7'] = combined_df.groupby(['Item', 'Company'])['Qty'].shift(7).fillna(0)
+
+    if artifact is not None:
+        le_company = artifact['le_company']
+        le_item = artifact['le_item']
+        version = _publish_model(combined_df, le_company, le_item, artifact['model'], artifact['company_mapping'],
+                                 fingerprint, artifact.get('training_metrics'), dataset)
+        log.info("Loaded saved model for data fingerprint %s (model version %d)", fingerprint[:12], version)
+        return version
 
     le_company = LabelEncoder()
     le_item = LabelEncoder()
 
-    combined_df['Company_Encoded'] = le_company.fit_transform(combined_df['Company'])
-    combined_df['Item_Encoded'] = le_item.fit_transform(combined_df['Item'])
-
-    features = ['Item_Encoded', 'Company_Encoded', 'Month', 'Day', 'Year', 'DayOfWeek', 'Quarter', 'Lag1', 'Lag7']
-    X = combined_df[features]
-    y = combined_df['Qty']
-
-    model = RandomForestRegressor(
-        n_estimators=200,
-        max_depth=15,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1
-    )
-    cv_scores = cross_val_score(model, X, y, cv=5, scoring='neg_mean_squared_error')
-    print(f"Cross-validation MSE: {-cv_scores.mean():.2f} (+/- {cv_scores.std() * 2:.2f})")
-    model.fit(X, y)
-    print("Model training complete")
-
-# Initial data load and preprocessing
+    # One training row per series and day, with or without sales; features come from the daily
+    # panel, the same way simulate_daily builds them while forecasting
+    with timed('features'):
+        company_codes = _encode_categorical(le_company, pd.Series(panel.companies), fit=True)
+        item_codes = _encode_categorical(le_item, pd.Series(panel.items), fit=True)
+        series, dates, window, y, weights = panel.training_rows()
+        X = feature_matrix(item_codes[series], company_codes[series], calendar_features(dates), window)
+    log.info("Built %d training rows from a %d series x %d day panel", len(y), len(panel), panel.n_days)
+
+    model, training_metrics = train_model(X, y, profile, weights)
+    model = _servable_model(model)
+    save_model_artifact(fingerprint, {
+        'model': model,
+        'le_company': le_company,
+        'le_item': le_item,
+        'company_mapping': company_mapping,
+        'features': FEATURES,
+        'training_metrics': training_metrics
+    })
+    # Serve the saved copy, which forecast worker processes map as well
+    saved = load_model_artifact(fingerprint)
+    if saved is not None:
+        model = saved['model']
+    version = _publish_model(combined_df, le_company, le_item, model, company_mapping, fingerprint, training_metrics, dataset)
+    log.info("Model training complete (model version %d)", version)
+    return version
+
+def train_model(X, y, profile, weights=None):
+    """Fit a profile's estimator on every row while its validation runs in a second thread.
+
+    X must be in Sale Date order, so validation only ever predicts rows that
+    come after the ones it trained on. weights are per-row sample weights,
+    also used to weight the validation errors. Returns the fitted estimator
+    and a dict of the profile, validation scheme, MAE/RMSE and seconds spent.
+    """
+    config = TRAINING_PROFILES[profile]
+    model = config['estimator'](**config['params'])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='validation') as pool:
+        validation = pool.submit(_validate_model, model, X, y, config, weights)
+        with timed('training'):
+            fit_start = time.perf_counter()
+            model.fit(X, y, sample_weight=weights)
+            train_seconds = time.perf_counter() - fit_start
+        training_metrics = validation.result()
+    training_metrics.update(profile=profile, rows=len(y), train_seconds=round(train_seconds, 3),
+                            total_seconds=round(time.perf_counter() - start, 3))
+    if training_metrics['mae'] is not None:
+        log.info("%s validation over %d fold(s): MAE %.2f, RMSE %.2f", training_metrics['validation'],
+                 training_metrics['folds'], training_metrics['mae'], training_metrics['rmse'])
+    log.info("Trained the %s profile in %.2fs (fit %.2fs, validation %.2fs)", profile,
+             training_metrics['total_seconds'], train_seconds, training_metrics['validation_seconds'])
+    return model, training_metrics
+
+def _validate_model(model, X, y, config, weights=None):
+    """Time-ordered out-of-sample MAE and RMSE of an unfitted estimator's configuration"""
+    if weights is None:
+        weights = np.ones(len(y))
+    start = time.perf_counter()
+    if config['validation'] == 'holdout':
+        cut = int(len(y) * (1 - config['holdout']))
+        splits = [(np.arange(cut), np.arange(cut, len(y)))] if 0 < cut < len(y) else []
+    else:
+        # Every fold needs at least one row to train on and one to score
+        n_splits = min(config['splits'], len(y) - 1)
+        splits = list(TimeSeriesSplit(n_splits=n_splits).split(X)) if n_splits >= 2 else []
+    errors, error_weights = [], []
+    with timed('cv'):
+        for train_rows, test_rows in splits:
+            fold_model = clone(model).fit(X[train_rows], y[train_rows], sample_weight=weights[train_rows])
+            errors.append(fold_model.predict(X[test_rows]) - y[test_rows])
+            error_weights.append(weights[test_rows])
+    if not errors:
+        log.warning("Too few rows to validate the model (%d)", len(y))
+        return {'validation': config['validation'], 'folds': 0, 'mae': None, 'rmse': None,
+                'validation_seconds': round(time.perf_counter() - start, 3)}
+    errors, error_weights = np.concatenate(errors), np.concatenate(error_weights)
+    return {
+        'validation': config['validation'],
+        'folds': len(splits),
+        'mae': float(np.average(np.abs(errors), weights=error_weights)),
+        'rmse': float(np.sqrt(np.average(errors ** 2, weights=error_weights))),
+        'validation_seconds': round(time.perf_counter() - start, 3)
+    }
+
+def _servable_model(estimator):
+    """The fitted estimator as it is saved and served.
+
+    A random forest is flattened into a FlatForest, whose node arrays load
+    memory-mapped. Gradient boosting predicts from its node arrays as they
+    are, so both kinds are shared by every process that maps the artifact.
+    """
+    if isinstance(estimator, RandomForestRegressor):
+        return FlatForest.from_estimator(estimator)
+    return estimator
+
+def _encode_categorical(encoder, values, fit=False):
+    """LabelEncoder codes of a column, transforming each distinct name once rather than every row"""
+    values = values.astype('category').cat.remove_unused_categories()
+    codes = values.cat.codes.to_numpy()
+    if (codes < 0).any():
+        # Missing names are rejected by the encoder just as before
+        return encoder.fit_transform(values) if fit else encoder.transform(values)
+    categories = values.cat.categories.to_numpy(dtype=object)
+    if fit:
+        encoder.fit(categories)
+    return encoder.transform(categories)[codes]
+
+def data_fingerprint(df, profile=None):
+    """Content hash of the training rows and the training profile's configuration"""
+    profile = profile or TRAINING_PROFILE
+    config = TRAINING_PROFILES[profile]
+    digest = hashlib.sha256()
+    digest.update(repr((ARTIFACT_FORMAT, FEATURES, ZERO_SAMPLE_RATIO, profile, config['estimator'].__name__,
+                        sorted(config['params'].items()))).encode())
+    rows = df[['Company', 'Sale Date', 'Item', 'Qty']]
+    digest.update(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _artifact_path(fingerprint):
+    return os.path.join(MODEL_DIR, f"model_{fingerprint}.joblib")
+
+def load_model_artifact(fingerprint):
+    """Load the saved model, encoders and schema for a data fingerprint, or None"""
+    path = _artifact_path(fingerprint)
+    if not os.path.exists(path):
+        return None
+    try:
+        # Memory-map the model's node arrays instead of copying them into the process
+        artifact = joblib.load(path, mmap_mode='r')
+        if artifact.get('features') != FEATURES:
+            log.warning("Ignoring model artifact %s: feature schema changed", path)
+            return None
+        return artifact
+    except Exception as e:
+        log.error("Error loading model artifact %s: %s", path, e)
+        return None
+
+def save_model_artifact(fingerprint, artifact):
+    """Save trained artifacts under their data fingerprint, keeping the newest few"""
+    try:
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        path = _artifact_path(fingerprint)
+        tmp_path = f"{path}.tmp"
+        joblib.dump(dict(artifact, fingerprint=fingerprint), tmp_path)
+        os.replace(tmp_path, path)
+        log.info("Model artifact saved to %s", path)
+        saved = sorted(
+            (os.path.join(MODEL_DIR, name) for name in os.listdir(MODEL_DIR)
+             if name.startswith('model_') and name.endswith('.joblib')),
+            key=os.path.getmtime
+        )
+        for old_path in saved[:-MAX_MODEL_ARTIFACTS]:
+            # Processes still mapping an older artifact keep it open; removing it may fail on Windows
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    except Exception as e:
+        log.error("Error saving model artifact: %s", e)
+
+def _forecast_cache_get(key):
+    """Return cached (items, daily predictions) for a key, or None"""
+    with _forecast_cache_lock:
+        entry = _forecast_cache.get(key)
+        if entry is None:
+            forecast_cache_stats['misses'] += 1
+            return None
+        _forecast_cache.move_to_end(key)
+        forecast_cache_stats['hits'] += 1
+        return entry[0], entry[1]
+
+def _forecast_cache_put(key, unique_items, daily_preds):
+    """Cache a daily forecast, evicting least recently used entries beyond the count or size limit"""
+    daily_preds.flags.writeable = False
+    size = daily_preds.nbytes + unique_items.nbytes
+    if size > FORECAST_CACHE_MAX_BYTES:
+        return
+    with _forecast_cache_lock:
+        previous = _forecast_cache.pop(key, None)
+        if previous is not None:
+            forecast_cache_stats['bytes'] -= previous[2]
+        _forecast_cache[key] = (unique_items, daily_preds, size)
+        forecast_cache_stats['bytes'] += size
+        while len(_forecast_cache) > FORECAST_CACHE_MAX_ENTRIES or forecast_cache_stats['bytes'] > FORECAST_CACHE_MAX_BYTES:
+            _, evicted = _forecast_cache.popitem(last=False)
+            forecast_cache_stats['bytes'] -= evicted[2]
+            forecast_cache_stats['evictions'] += 1
+
+def clear_forecast_cache():
+    """Drop every cached forecast, e.g. after a new model has been published"""
+    with _forecast_cache_lock:
+        _forecast_cache.clear()
+        forecast_cache_stats['bytes'] = 0
+
+def get_forecast_cache_stats():
+    """Hit/miss/eviction counters and current size of the forecast cache"""
+    with _forecast_cache_lock:
+        return dict(forecast_cache_stats, entries=len(_forecast_cache))
+
+def _company_codes(company_names, company_encoder):
+    """Trained company code of each NameIndex entry, -1 for names the model was not trained on"""
+    codes = {}
+    for code, cname in enumerate(company_encoder.classes_):
+        codes.setdefault(normalize_company(cname), code)
+    return np.array([codes.get(name, -1) for name in company_names.names], dtype=np.int64)
+
+def _forecast_lookups(trained_df, company_encoder, item_encoder, panel, company_names):
+    """Name lookups and forecast seeds, built once per model instead of once per request.
+
+    company_codes holds the trained company code of every entry of
+    company_names, the NameIndex quantity lookups use, so forecasts resolve
+    names the same way. items/item_codes are the trained items in order of
+    first appearance with their encoded values. The seed table holds the daily
+    panel's last WINDOW days for every (company, item) series: seed_window has
+    one row per series, seed_items the series' item positions in items,
+    seed_rows their rows in the panel, and seed_spans maps a stripped company
+    name to its slice of rows. The panel itself seeds forecasts that start
+    inside the history.
+    """
+    items = np.asarray(trained_df['Item'].unique(), dtype=object)
+    key_codes, keys = pd.factorize(pd.Series(panel.companies, dtype=object).astype(str).str.strip())
+    # Group the series by company key, so each company's series are one contiguous block
+    order = np.argsort(key_codes, kind='stable')
+    key_codes = key_codes[order]
+    seed_window = panel.window(series=order)
+    seed_items = pd.Index(items).get_indexer(panel.items[order])
+    company_starts = np.flatnonzero(np.r_[True, key_codes[1:] != key_codes[:-1]]) if len(order) else np.array([], dtype=np.int64)
+    company_ends = np.r_[company_starts[1:], len(order)]
+    seed_spans = {keys[key_codes[start]]: (int(start), int(end)) for start, end in zip(company_starts, company_ends)}
+    return {
+        'company_codes': _company_codes(company_names, company_encoder),
+        'items': items,
+        'item_codes': item_encoder.transform(items),
+        'seed_spans': seed_spans,
+        'seed_items': seed_items,
+        'seed_rows': order,
+        'seed_window': seed_window,
+        'panel': panel
+    }
+
+def _publish_model(trained_df, company_encoder, item_encoder, estimator, companies, fingerprint=None,
+                   training_metrics=None, dataset=None):
+    """Atomically swap in a newly trained model together with the data it was trained on.
+
+    dataset is the snapshot trained_df came from; its panel and company index are reused.
+    """
+    global model_state
+    if dataset is None:
+        index = _build_quantity_index(trained_df)
+        dataset = DataSnapshot(panel=DailyPanel.from_rows(trained_df), quantity_index=index, company_names=NameIndex(index))
+    lookups = _forecast_lookups(trained_df, company_encoder, item_encoder, dataset.panel, dataset.company_names)
+    with _model_lock:
+        version = (model_state['version'] if model_state else _published_version()) + 1
+        # Readers take model_state in a single reference read, so they never see a mix of versions
+        model_state = DataSnapshot(
+            version=version,
+            combined_df=trained_df,
+            le_company=company_encoder,
+            le_item=item_encoder,
+            model=estimator,
+            company_mapping=companies,
+            # Saved copy of the model that forecast worker processes load
+            artifact_path=_artifact_path(fingerprint) if fingerprint else None,
+            training_metrics=training_metrics,
+            # The trained data's company index, shared with quantity lookups on that data
+            quantity_index=dataset.quantity_index,
+            company_names=dataset.company_names,
+            **lookups
+        )
+    # Forecasts of older versions can no longer be requested
+    clear_forecast_cache()
+    return version
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+def submit_training():
+    """Queue a background preprocess_data run and return its job id"""
+    global _latest_training_job
+    if SERVING_MODE == 'worker':
+        # The trainer process picks new data up from the store; the id names the store version to wait for
+        mtime_ns, size = store.version()
+        return f"store-{mtime_ns}-{size}"
+    job_id = uuid.uuid4().hex
+    with _training_jobs_lock:
+        training_jobs[job_id] = {
+            'job_id': job_id,
+            'status': 'queued',
+            'submitted_at': _now(),
+            'started_at': None,
+            'finished_at': None,
+            'model_version': None,
+            'training_metrics': None,
+            'error': None
+        }
+        _latest_training_job = job_id
+        # Forget the oldest finished jobs so the registry stays bounded
+        finished = [jid for jid, job in training_jobs.items() if job['finished_at'] is not None]
+        for jid in finished[:max(0, len(training_jobs) - MAX_TRAINING_JOBS)]:
+            del training_jobs[jid]
+    _training_executor.submit(_run_training_job, job_id)
+    log.info("Training job %s queued", job_id)
+    return job_id
+
+def _run_training_job(job_id):
+    job = training_jobs[job_id]
+    if job_id != _latest_training_job:
+        # A newer upload is queued behind this one and its training covers this data too
+        job.update(status='superseded', finished_at=_now())
+        return
+    job.update(status='running', started_at=_now())
+    try:
+        result = preprocess_data()
+    except Exception as e:
+        log.exception("Training job %s raised", job_id)
+        result = f"Error: {str(e)}"
+    if isinstance(result, str):
+        job.update(status='failed', error=result, finished_at=_now())
+    else:
+        state = model_state
+        training_metrics = state['training_metrics'] if state and state['version'] == result else None
+        job.update(status='completed', model_version=result, training_metrics=training_metrics, finished_at=_now())
+    log.info("Training job %s %s", job_id, job['status'])
+
+def get_training_status(job_id):
+    """Return a copy of a training job's status, or None for an unknown id"""
+    if SERVING_MODE == 'worker':
+        return _published_training_status(job_id)
+    with _training_jobs_lock:
+        job = training_jobs.get(job_id)
+        return dict(job) if job else None
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    # Write then rename, so readers in other processes never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _published_version():
+    """Version of the last published model, so a restarted trainer keeps counting up"""
+    if SERVING_MODE != 'trainer':
+        return 0
+    published = _read_json(PUBLISHED_MODEL_PATH)
+    return published['version'] if published else 0
+
+def _snapshot_path(version):
+    return os.path.join(MODEL_DIR, f"snapshot_v{version}.joblib")
+
+def publish_serving_snapshot(store_version):
+    """Trainer: save what workers need to serve the current model and point current.json at it.
+
+    The snapshot holds the training rows forecasts seed from, the quantity
+    prefix-sum index and the name lookups, saved next to the model artifact.
+    """
+    state = model_state
+    artifact_path = state['artifact_path']
+    if not artifact_path or not os.path.exists(artifact_path):
+        raise RuntimeError("Model artifact was not saved, nothing to publish")
+    # Reused artifacts keep their old mtime; touch it so pruning keeps the published one
+    os.utime(artifact_path)
+    path = _snapshot_path(state['version'])
+    tmp_path = f"{path}.tmp"
+    joblib.dump({
+        'history': state['combined_df'][['Company', 'Sale Date', 'Item', 'Qty']].reset_index(drop=True),
+        'quantity_index': state['quantity_index'],
+        'company_mapping': state['company_mapping'],
+        'company_codes': state['company_codes'],
+        'seed_spans': state['seed_spans'],
+        'seed_items': state['seed_items'],
+        'seed_window': state['seed_window'],
+        'seed_rows': state['seed_rows'],
+        'panel': state['panel'],
+        'items': state['items'],
+        'item_codes': state['item_codes']
+    }, tmp_path)
+    os.replace(tmp_path, path)
+    _write_json(PUBLISHED_MODEL_PATH, {
+        'version': state['version'],
+        'artifact': artifact_path,
+        'snapshot': path,
+        'store_version': list(store_version),
+        'training_metrics': state['training_metrics'],
+        'published_at': _now()
+    })
+    log.info("Published model version %d to %s", state['version'], PUBLISHED_MODEL_PATH)
+    # Workers still mapping an older snapshot keep it open; removing it may fail on Windows
+    snapshots = sorted((name for name in os.listdir(MODEL_DIR) if re.fullmatch(r'snapshot_v\d+\.joblib', name)),
+                       key=lambda name: int(name[len('snapshot_v'):-len('.joblib')]))
+    for name in snapshots[:-MAX_MODEL_ARTIFACTS]:
+        try:
+            os.remove(os.path.join(MODEL_DIR, name))
+        except OSError:
+            pass
+
+def run_trainer(poll_seconds=TRAINER_POLL_SECONDS):
+    """Trainer: retrain and publish a snapshot whenever the stored history changes; runs until stopped"""
+    published = _read_json(PUBLISHED_MODEL_PATH)
+    trained = tuple(published['store_version']) if published else None
+    # Imports a legacy Excel history into the store on first start
+    _cached_dataset()
+    log.info("Trainer watching %s", store.path)
+    while True:
+        store_version = store.version()
+        if store_version is not None and store_version != trained:
+            status = {'store_version': list(store_version), 'started_at': _now(), 'finished_at': None,
+                      'model_version': None, 'training_metrics': None, 'error': None}
+            _write_json(TRAINER_STATUS_PATH, dict(status, status='running'))
+            try:
+                result = preprocess_data()
+                if not isinstance(result, str):
+                    publish_serving_snapshot(store_version)
+            except Exception as e:
+                log.exception("Training for store version %s raised", store_version)
+                result = f"Error: {str(e)}"
+            if isinstance(result, str):
+                status.update(status='failed', error=result)
+            else:
+                status.update(status='completed', model_version=result, training_metrics=model_state['training_metrics'])
+            _write_json(TRAINER_STATUS_PATH, dict(status, finished_at=_now()))
+            trained = store_version
+        time.sleep(poll_seconds)
+
+def _published_training_status(job_id):
+    """Worker: status of the training a store-version job id waits for, from the trainer's files"""
+    match = re.fullmatch(r'store-(\d+)-(\d+)', job_id)
+    if match is None:
+        return None
+    needed = int(match.group(1))
+    status = {
+        'job_id': job_id,
+        'status': 'queued',
+        'submitted_at': datetime.fromtimestamp(needed / 1e9).isoformat(timespec='seconds'),
+        'started_at': None,
+        'finished_at': None,
+        'model_version': None,
+        'training_metrics': None,
+        'error': None
+    }
+    # Store versions start with the file's mtime, so any later training covers this upload too
+    published = _read_json(PUBLISHED_MODEL_PATH)
+    if published and published['store_version'][0] >= needed:
+        status.update(status='completed', model_version=published['version'],
+                      training_metrics=published.get('training_metrics'), finished_at=published['published_at'])
+        return status
+    training = _read_json(TRAINER_STATUS_PATH)
+    if training and training['store_version'][0] >= needed:
+        status.update({key: training[key] for key in ['status', 'started_at', 'finished_at', 'error']})
+    return status
+
+_serving_lock = threading.Lock()
+_last_publish_check = 0.0
+
+def sync_published_model(force=False):
+    """Worker: switch to the trainer's latest published model, at most once per PUBLISH_POLL_SECONDS.
+
+    The model's node arrays and the snapshot's numeric arrays (quantities,
+    prefix sums, seed windows) are memory-mapped read-only, so workers share
+    one copy of them through the page cache; the name and date columns are
+    copied into each worker.
+    """
+    global model_state, _last_publish_check
+    if SERVING_MODE != 'worker':
+        return
+    now = time.monotonic()
+    if not force and now - _last_publish_check < PUBLISH_POLL_SECONDS:
+        return
+    _last_publish_check = now
+    published = _read_json(PUBLISHED_MODEL_PATH)
+    if published is None or (model_state is not None and model_state['version'] == published['version']):
+        return
+    with _serving_lock:
+        if model_state is not None and model_state['version'] == published['version']:
+            return
+        try:
+            artifact = joblib.load(published['artifact'], mmap_mode='r')
+            snapshot = joblib.load(published['snapshot'], mmap_mode='r')
+        except Exception as e:
+            log.error("Error loading published model version %s: %s", published['version'], e)
+            return
+        state = DataSnapshot(
+            version=published['version'],
+            combined_df=snapshot['history'],
+            le_company=artifact['le_company'],
+            le_item=artifact['le_item'],
+            model=artifact['model'],
+            company_mapping=snapshot['company_mapping'],
+            artifact_path=published['artifact'],
+            training_metrics=published.get('training_metrics'),
+            company_codes=snapshot['company_codes'],
+            seed_spans=snapshot['seed_spans'],
+            seed_items=snapshot['seed_items'],
+            seed_window=snapshot['seed_window'],
+            seed_rows=snapshot['seed_rows'],
+            panel=snapshot['panel'],
+            items=snapshot['items'],
+            item_codes=snapshot['item_codes'],
+            quantity_index=snapshot['quantity_index'],
+            # Built from the same index as the trainer's, so company_codes lines up with it
+            company_names=NameIndex(snapshot['quantity_index'])
+        )
+        with _model_lock:
+            model_state = state
+        clear_forecast_cache()
+    log.info("Serving published model version %d", published['version'])
+
+# Initial data load and preprocessing; forecast worker processes only need the module's functions.
+# The trainer trains from run_trainer and workers serve what it publishes.
 try:
-    combined_df = load_excel_data()
-    if not combined_df.empty:
-        preprocess_data()
+    if multiprocessing.parent_process() is None and SERVING_MODE == 'standalone':
+        if not _cached_dataset().empty:
+            preprocess_data()
+    elif multiprocessing.parent_process() is None and SERVING_MODE == 'worker':
+        sync_published_model(force=True)
 except Exception as e:
-    print(f"Error during initial data load: {str(e)}")
-    combined_df = pd.DataFrame(columns=['Sale Date', 'Item', 'Qty', 'Company'])
+    log.error("Error during initial data load: %s", e)
 
 # DATA FETCHER FUNCTIONS
 def get_total_quantity(company, from_date, to_date):
     try:
-        # Ensure we have the latest data
-        global combined_df
-        combined_df = load_excel_data()
+        # Served from the in-memory dataset and its per-company prefix-sum index
+        data_df, quantity_index, company_names = get_quantity_index()
             
-        if combined_df.empty:
-            print("Warning: No data available for quantity calculation")
-            # Create an empty result and save it
-            result = {
+        if data_df.empty:
+            log.warning("No data available for quantity calculation")
+            # Log an empty result
+            _log_fetched_quantities([{
                 'Company Name': company,
                 'From Date': pd.to_datetime(from_date).strftime('%Y-%m-%d'),
                 'To Date': pd.to_datetime(to_date).strftime('%Y-%m-%d'),
                 'Total Quantity': 0
-            }
-            df_result = pd.DataFrame([result])
-            
-            # Save to data_fetched.xlsx
-            file_path = os.path.join(OUTPUT_DIR, 'data_fetched.xlsx')
-            df_result.to_excel(file_path, index=False)
-            print(f"Empty result saved to {file_path}")
+            }])
             
             return 0
         
         # Check if Company column exists
-        if 'Company' not in combined_df.columns:
-            print(f"Error: 'Company' column not found. Available columns: {list(combined_df.columns)}")
+        if 'Company' not in data_df.columns:
+            log.error("'Company' column not found. Available columns: %s", list(data_df.columns))
             return "Error: 'Company' column not found in the data"
         
         # Parse input dates
         from_date = pd.to_datetime(from_date)
         to_date = pd.to_datetime(to_date)
         
-        print(f"DEBUG - Input: company={company}, from_date={from_date}, to_date={to_date}")
-        print(f"DEBUG - combined_df shape: {combined_df.shape}")
-        print(f"DEBUG - company values: {combined_df['Company'].unique()}")
+        log.debug("Input: company=%s, from_date=%s, to_date=%s", company, from_date, to_date)
         
-        # Ensure 'Sale Date' is in datetime format
-        if 'Sale Date' not in combined_df.columns:
-            print(f"Error: 'Sale Date' column not found. Available columns: {list(combined_df.columns)}")
+        if 'Sale Date' not in data_df.columns:
+            log.error("'Sale Date' column not found. Available columns: %s", list(data_df.columns))
             return "Error: 'Sale Date' column not found in the data"
         
-        combined_df['Sale Date'] = combined_df['Sale Date'].apply(parse_date)
-        
-        # Check for null values in the date column
-        if combined_df['Sale Date'].isnull().any():
-            print("Warning: Some dates could not be parsed properly")
-            combined_df = combined_df.dropna(subset=['Sale Date'])
-        
-        if combined_df.empty:
-            print("Warning: No valid data after cleaning")
+        # Rows with unparseable dates are left out of the index
+        if not quantity_index:
+            log.warning("No valid data after cleaning")
             return 0
-            
-        print(f"DEBUG - Data date range: {combined_df['Sale Date'].min()} to {combined_df['Sale Date'].max()}")
 
-        # Clean company parameter to match data format - FIXED THIS LINE
-        clean_company = company.strip().replace('\xa0', ' ')
-        clean_company = re.sub(r'\s+', ' ', clean_company)  # Use re.sub instead of string replace with regex
-        print(f"DEBUG - Cleaned input company name: '{clean_company}'")
-        
-        # Compare company names by normalized strings (case-insensitive, normalized spaces)
-        company_match = combined_df['Company'].str.lower().str.strip() == clean_company.lower().strip()
-        
-        # If no exact match, try fuzzy matching
-        if company_match.sum() == 0:
-            print(f"WARNING: No exact match for company '{clean_company}'. Available companies: {combined_df['Company'].unique()}")
-            # Try to find the closest match
-            for comp in combined_df['Company'].unique():
-                if clean_company.lower().strip() in comp.lower().strip() or comp.lower().strip() in clean_company.lower().strip():
-                    print(f"Found approximate match: '{comp}' for '{clean_company}'")
-                    company_match = combined_df['Company'] == comp
-                    break
-        
-        date_min_match = combined_df['Sale Date'] >= from_date
-        date_max_match = combined_df['Sale Date'] <= to_date
+        # Clean company parameter to match data format
+        clean_company = normalize_company(company)
+        log.debug("Cleaned input company name: '%s'", clean_company)
         
-        print(f"DEBUG - Records matching company '{clean_company}': {company_match.sum()}")
-        print(f"DEBUG - Records on or after {from_date}: {date_min_match.sum()}")
-        print(f"DEBUG - Records on or before {to_date}: {date_max_match.sum()}")
-        
-        filtered_data = combined_df[company_match & date_min_match & date_max_match]
-        
-        print(f"DEBUG - Filtered data shape: {filtered_data.shape}")
-        if not filtered_data.empty:
-            print(f"DEBUG - Filtered data sample:\n{filtered_data[['Sale Date', 'Item', 'Qty']].head().to_string()}")
-        
-        if filtered_data.empty:
-            print(f"DEBUG - No data found for company '{clean_company}' between {from_date} and {to_date}")
-            total_qty = 0
-        else:
-            total_qty = filtered_data['Qty'].sum()
-            print(f"DEBUG - Raw total quantity: {total_qty}")
+        with timed('filter'):
+            # Compare company names by normalized strings (case-insensitive, normalized spaces)
+            entry = quantity_index.get(clean_company)
             
-            total_qty = total_qty if not pd.isna(total_qty) else 0
-            total_qty = int(total_qty) if isinstance(total_qty, (int, float, np.number)) else 0
+            # If no exact match, try fuzzy matching
+            if entry is None:
+                log.debug("No exact match for company '%s'", clean_company)
+                # Try to find the closest match
+                comp = _match_quantity_key(company_names, clean_company)
+                if comp is not None:
+                    log.debug("Found approximate match: '%s' for '%s'", comp, clean_company)
+                    entry = quantity_index[comp]
             
-            print(f"DEBUG - Final total quantity (Python type {type(total_qty)}): {total_qty}")
+            if entry is None:
+                log.debug("No data found for company '%s' between %s and %s", clean_company, from_date, to_date)
+                total_qty = 0
+            else:
+                total_qty = _range_total(entry, from_date, to_date)
+                total_qty = total_qty if not pd.isna(total_qty) else 0
+                total_qty = int(total_qty) if isinstance(total_qty, (int, float, np.number)) else 0
+                log.debug("Total quantity: %s", total_qty)
         
-        # Create result dataframe
-        result = {
+        # Log the result unless this query is already logged
+        _log_fetched_quantities([{
             'Company Name': company,
             'From Date': from_date.strftime('%Y-%m-%d'),
             'To Date': to_date.strftime('%Y-%m-%d'),
             'Total Quantity': total_qty
-        }
-        df_result = pd.DataFrame([result])
-        
-        # Save to data_fetched.xlsx
-        file_path = os.path.join(OUTPUT_DIR, 'data_fetched.xlsx')
-        
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        }])
         
-        # Check if file exists to append or create new
-        if os.path.exists(file_path):
-            try:
-                existing_df = pd.read_excel(file_path)
-                # Check for duplicate based on Company Name, From Date, and To Date
-                existing_df['From Date'] = pd.to_datetime(existing_df['From Date']).dt.strftime('%Y-%m-%d')
-                existing_df['To Date'] = pd.to_datetime(existing_df['To Date']).dt.strftime('%Y-%m-%d')
-                is_duplicate = existing_df[
-                    (existing_df['Company Name'].str.strip() == company.strip()) &
-                    (existing_df['From Date'] == from_date.strftime('%Y-%m-%d')) &
-                    (existing_df['To Date'] == to_date.strftime('%Y-%m-%d'))
-                ]
-                if not is_duplicate.empty:
-                    print(f"Duplicate record found for {company} from {from_date} to {to_date}, skipping append")
-                    return total_qty
-                df_result = pd.concat([existing_df, df_result], ignore_index=True)
-            except Exception as e:
-                print(f"Error reading existing file, creating new one: {str(e)}")
+        return total_qty
+    except Exception as e:
+        log.exception("Error in get_total_quantity")
+        return f"Error: {str(e)}"
+
+def _match_quantity_key(company_names, clean_company):
+    """Index key for a normalized company name, falling back to a substring match, or None"""
+    match = company_names.match(clean_company)
+    return company_names.names[match] if match is not None else None
+
+def _fetch_log_key(company, from_date, to_date):
+    # Duplicates are judged on Company Name, From Date and To Date
+    return (str(company).strip(), from_date, to_date)
+
+@contextmanager
+def _file_lock(path):
+    """Hold an exclusive lock on path across processes"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
         else:
-            print(f"Creating new file: {file_path}")
-        
-        # Save the result
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _read_fetch_log_keys(offset):
+    """Keys of the rows in the log from byte offset on, and the offset of its end; call under the file lock"""
+    if not os.path.exists(FETCH_LOG_PATH):
+        return set(), 0
+    if os.path.getsize(FETCH_LOG_PATH) < offset:
+        # The log was replaced; read it again from the start
+        offset = 0
+    with open(FETCH_LOG_PATH, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    if not data:
+        return set(), offset
+    logged = pd.read_csv(io.BytesIO(data), header=None, names=FETCH_LOG_COLUMNS, skiprows=1 if offset == 0 else 0,
+                         usecols=FETCH_LOG_COLUMNS[:3], dtype=str, keep_default_na=False)
+    return {_fetch_log_key(*row) for row in logged.itertuples(index=False, name=None)}, offset + len(data)
+
+def _load_fetch_log_keys():
+    """Read the logged query keys once, importing a legacy data_fetched.xlsx into the log first"""
+    global _fetch_log_keys, _fetch_log_offset
+    with _fetch_log_write_lock, _file_lock(FETCH_LOG_LOCK_PATH):
+        if _fetch_log_keys is not None:
+            return
+        _import_legacy_fetch_log()
+        keys, _fetch_log_offset = _read_fetch_log_keys(0)
+        with _fetch_log_lock:
+            _fetch_log_keys = keys
+
+def _import_legacy_fetch_log():
+    if not os.path.exists(FETCH_LOG_PATH) and os.path.exists(LEGACY_FETCH_LOG_PATH):
         try:
-            df_result.to_excel(file_path, index=False)
-            print(f"Total quantity data saved to {file_path}")
+            legacy = pd.read_excel(LEGACY_FETCH_LOG_PATH)
+            legacy['From Date'] = pd.to_datetime(legacy['From Date']).dt.strftime('%Y-%m-%d')
+            legacy['To Date'] = pd.to_datetime(legacy['To Date']).dt.strftime('%Y-%m-%d')
+            legacy[FETCH_LOG_COLUMNS].to_csv(FETCH_LOG_PATH, index=False)
+            log.info("Imported %d logged quantities from %s", len(legacy), LEGACY_FETCH_LOG_PATH)
         except Exception as e:
-            print(f"Error saving total quantity data: {str(e)}")
-        
-        return total_qty
+            log.error("Error importing %s: %s", LEGACY_FETCH_LOG_PATH, e)
+
+def _log_fetched_quantities(records):
+    """Queue quantity results for the append-only log, skipping already logged queries"""
+    global _fetch_log_flush_scheduled
+    if _fetch_log_keys is None:
+        _load_fetch_log_keys()
+    with _fetch_log_lock:
+        for record in records:
+            key = _fetch_log_key(record['Company Name'], record['From Date'], record['To Date'])
+            if key in _fetch_log_keys:
+                continue
+            _fetch_log_keys.add(key)
+            _fetch_log_pending.append(record)
+        if _fetch_log_pending and not _fetch_log_flush_scheduled:
+            _fetch_log_flush_scheduled = True
+            _fetch_log_executor.submit(_delayed_fetch_log_flush)
+
+def _delayed_fetch_log_flush():
+    # Let results pile up briefly so they are written in one append
+    time.sleep(FETCH_LOG_FLUSH_SECONDS)
+    flush_fetch_log()
+
+def flush_fetch_log():
+    """Append queued quantity results to the fetched-data log.
+
+    Other serving processes append to the same file, so the append happens
+    under a file lock after reading what they logged since this process last
+    looked, and queries one of them already logged are dropped.
+    """
+    global _fetch_log_pending, _fetch_log_flush_scheduled, _fetch_log_offset
+    with _fetch_log_write_lock:
+        with _fetch_log_lock:
+            batch, _fetch_log_pending = _fetch_log_pending, []
+            _fetch_log_flush_scheduled = False
+        if not batch:
+            return
+        try:
+            with _file_lock(FETCH_LOG_LOCK_PATH):
+                logged, _fetch_log_offset = _read_fetch_log_keys(_fetch_log_offset)
+                with _fetch_log_lock:
+                    _fetch_log_keys.update(logged)
+                batch = [record for record in batch if _fetch_log_key(
+                    record['Company Name'], record['From Date'], record['To Date']) not in logged]
+                if not batch:
+                    return
+                write_header = not os.path.exists(FETCH_LOG_PATH)
+                pd.DataFrame(batch, columns=FETCH_LOG_COLUMNS).to_csv(
+                    FETCH_LOG_PATH, mode='a', header=write_header, index=False)
+                _fetch_log_offset = os.path.getsize(FETCH_LOG_PATH)
+            log.debug("Logged %d quantity results to %s", len(batch), FETCH_LOG_PATH)
+        except Exception as e:
+            log.error("Error saving total quantity data: %s", e)
+            with _fetch_log_lock:
+                _fetch_log_pending[:0] = batch
+
+# Do not lose queued results on shutdown
+atexit.register(flush_fetch_log)
+
+def export_fetch_log(file_path=LEGACY_FETCH_LOG_PATH):
+    """Write the fetched-data log to an Excel workbook on demand"""
+    flush_fetch_log()
+    with _file_lock(FETCH_LOG_LOCK_PATH):
+        if os.path.exists(FETCH_LOG_PATH):
+            logged = pd.read_csv(FETCH_LOG_PATH)
+        else:
+            logged = pd.DataFrame(columns=FETCH_LOG_COLUMNS)
+    with timed('excel_write'):
+        logged.to_excel(file_path, index=False)
+    log.info("Fetched quantity log exported to %s", file_path)
+    return file_path
+
+def get_total_quantities(queries):
+    """
+    Total Qty for many {company, from_date, to_date} queries from one dataset snapshot
+    Queries are grouped by company and answered with vectorized binary searches over that
+    company's prefix sums; all results are queued for the fetched-data log at once.
+    Returns one result dict per query, with 'error' set for queries that could not be answered.
+    """
+    try:
+        data_df, quantity_index, company_names = get_quantity_index()
+        if not data_df.empty:
+            for column in ['Company', 'Sale Date']:
+                if column not in data_df.columns:
+                    return f"Error: '{column}' column not found in the data"
+
+        queries = [query if isinstance(query, dict) else {} for query in queries]
+        companies = [query.get('company') for query in queries]
+        from_dates = pd.to_datetime(pd.Series([q.get('from_date') for q in queries], dtype=object),
+                                    errors='coerce', format='mixed')
+        to_dates = pd.to_datetime(pd.Series([q.get('to_date') for q in queries], dtype=object),
+                                  errors='coerce', format='mixed')
+        valid = from_dates.notna() & to_dates.notna()
+        valid &= pd.Series([isinstance(company, str) and bool(company.strip()) for company in companies])
+
+        # Resolve each distinct company name once
+        clean_names = pd.Series(companies, dtype=object)[valid].map(normalize_company)
+        resolved = {name: _match_quantity_key(company_names, name) for name in clean_names.unique()}
+        keys = clean_names.map(resolved).dropna()
+
+        totals = np.zeros(len(queries))
+        from_ns = from_dates.to_numpy(dtype='datetime64[ns]')
+        to_ns = to_dates.to_numpy(dtype='datetime64[ns]')
+        with timed('filter'):
+            for key, positions in keys.groupby(keys).groups.items():
+                dates, cum_qty = quantity_index[key]
+                positions = positions.to_numpy()
+                start = np.searchsorted(dates, from_ns[positions], side='left')
+                end = np.searchsorted(dates, to_ns[positions], side='right')
+                # A reversed range has end <= start and totals 0, as a single query does
+                totals[positions] = np.where(end > start, cum_qty[end] - cum_qty[start], 0)
+        totals = np.nan_to_num(totals).astype(np.int64)
+
+        results, records = [], []
+        for i, (query, company) in enumerate(zip(queries, companies)):
+            result = {'company': company, 'from_date': query.get('from_date'), 'to_date': query.get('to_date')}
+            if not valid[i]:
+                result['error'] = 'Missing or invalid company, from_date or to_date'
+            else:
+                result['total_quantity'] = int(totals[i])
+                records.append({
+                    'Company Name': company,
+                    'From Date': from_dates[i].strftime('%Y-%m-%d'),
+                    'To Date': to_dates[i].strftime('%Y-%m-%d'),
+                    'Total Quantity': int(totals[i])
+                })
+            results.append(result)
+
+        log.debug("Answered %d of %d quantity queries for %d companies", len(records), len(queries), len(resolved))
+        if records:
+            _log_fetched_quantities(records)
+        return results
     except Exception as e:
-        import traceback
-        print(f"ERROR in get_total_quantity: {str(e)}")
-        print(traceback.format_exc())
+        log.exception("Error in get_total_quantities")
         return f"Error: {str(e)}"
 
 # FORECASTER FUNCTIONS
-def forecast_quantity(company, from_date, to_date, frequency):
+def simulate_daily(estimator, item_codes, company_codes, window, daily_range):
+    """Step the recursive Lag1/Lag7 forecast one day at a time for many series at once.
+
+    window holds each series' last WINDOW days before daily_range, oldest
+    first; every prediction is pushed onto it, so Lag7 is the value seven
+    calendar days back just as in training. Every series is predicted in a
+    single model.predict call per day, so the number of predict calls depends
+    on the horizon only, not on the item count.
+    Returns an array of shape (series, days) holding predictions rounded to 2 places.
+    """
+    n_series = len(item_codes)
+    preds = np.empty((n_series, len(daily_range)))
+    window = np.array(window, dtype=float).reshape(n_series, WINDOW)
+    calendar = calendar_features(daily_range)
+
+    # Feature matrix laid out in FEATURES order, reused for every step
+    X = np.empty((n_series, len(FEATURES)))
+    for j in range(len(daily_range)):
+        feature_matrix(item_codes, company_codes, calendar[j], window, out=X)
+        pred = estimator.predict(X) if n_series else np.empty(0)
+        preds[:, j] = pred
+        window[:, :-1] = window[:, 1:]
+        window[:, -1] = pred
+    return np.round(preds, 2)
+
+def _period_groups(daily_range, frequency):
+    """Group day positions of daily_range into Weekly or Monthly periods with their labels"""
+    dates = pd.Series(daily_range)
+    if frequency == 'Weekly':
+        keys = [dates.dt.year, dates.dt.isocalendar().week]
+        suffix = 'Week'
+    else:
+        keys = [dates.dt.year, dates.dt.month]
+        suffix = 'Month'
+    groups = []
+    for (year, period), positions in sorted(dates.groupby(keys).indices.items()):
+        last_date = daily_range[positions[-1]]
+        groups.append((f"{last_date.strftime('%d-%b-%Y')} ({suffix} {period})", positions))
+    return groups
+
+def _seed_window(state, company, day=None):
+    """WINDOW days before panel day `day` of every trained item for a company; 0 where it has no history.
+
+    The default, the day after the history ends, comes from the seed table.
+    """
+    window = np.zeros((len(state['items']), WINDOW))
+    span = state['seed_spans'].get(company.strip())
+    if span is not None:
+        start, end = span
+        if day is None:
+            window[state['seed_items'][start:end]] = state['seed_window'][start:end]
+        else:
+            window[state['seed_items'][start:end]] = state['panel'].window(series=state['seed_rows'][start:end], day=day)
+    return window
+
+def _simulation_days(state, daily_range):
+    """Days to simulate for daily_range, the panel day the seed window ends before, and how many leading days to drop.
+
+    Lag1/Lag7 must be the days right before each simulated day. A range after
+    the history is rolled forward from the day after the history ends and the
+    days before daily_range are dropped; one starting inside the history is
+    seeded with the history before its first day (day None: the seed table).
+    """
+    panel = state['panel']
+    if panel.start is None or len(daily_range) == 0:
+        return daily_range, None, 0
+    after_history = pd.Timestamp(panel.start) + pd.Timedelta(days=panel.n_days)
+    if daily_range[0] >= after_history:
+        days = pd.date_range(after_history, daily_range[-1], freq='D')
+        return days, None, len(days) - len(daily_range)
+    return daily_range, (daily_range[0] - pd.Timestamp(panel.start)).days, 0
+
+def _daily_forecast(state, company, daily_range):
+    """Simulate daily predictions for every item of a company under one model state"""
+    trained_df, le_company, model = state['combined_df'], state['le_company'], state['model']
+    # Items are encoded once per model, not per request
+    unique_items, item_codes = state['items'], state['item_codes']
+    company_code = le_company.transform([company])[0]
+
+    # Seed every item with the history just before the first simulated day
+    days, seed_day, skip = _simulation_days(state, daily_range)
+    with timed('filter'):
+        window = _seed_window(state, company, seed_day)
+
+    # Generate daily predictions for all items together
+    company_codes = np.full(len(unique_items), company_code)
+    with timed('predict_loop'):
+        daily_preds = simulate_daily(model, item_codes, company_codes, window, days)[:, skip:]
+    return unique_items, daily_preds
+
+def _simulate_shard(artifact_path, item_codes, company_codes, window, daily_range):
+    """Forecast worker task: simulate a shard of series with the model memory-mapped from its artifact"""
+    estimator = _worker_estimators.get(artifact_path)
+    if estimator is None:
+        estimator = joblib.load(artifact_path, mmap_mode='r')['model']
+        _worker_estimators.clear()
+        _worker_estimators[artifact_path] = estimator
+    return simulate_daily(estimator, item_codes, company_codes, window, daily_range)
+
+def _get_forecast_pool():
+    global _forecast_pool
+    with _forecast_pool_lock:
+        if _forecast_pool is None:
+            # Spawned workers do not inherit the web server's threads and locks
+            _forecast_pool = ProcessPoolExecutor(max_workers=FORECAST_WORKERS,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return _forecast_pool
+
+def _reset_forecast_pool():
+    global _forecast_pool
+    with _forecast_pool_lock:
+        if _forecast_pool is not None:
+            _forecast_pool.shutdown(wait=False, cancel_futures=True)
+        _forecast_pool = None
+
+def simulate_series(state, item_codes, company_codes, window, daily_range):
+    """simulate_daily for a batch of (company, item) series under one model state.
+
+    Large batches are split into one shard per forecast worker process; each
+    worker memory-maps the state's saved model artifact and keeps it for later
+    batches. Small batches, or a state without a saved artifact, are simulated
+    in this process.
+    """
+    artifact_path = state.get('artifact_path')
+    with timed('predict_loop'):
+        if (len(item_codes) < FORECAST_POOL_MIN_SERIES or FORECAST_WORKERS < 2
+                or not artifact_path or not os.path.exists(artifact_path)):
+            return simulate_daily(state['model'], item_codes, company_codes, window, daily_range)
+        try:
+            pool = _get_forecast_pool()
+            shards = np.array_split(np.arange(len(item_codes)), FORECAST_WORKERS)
+            futures = [pool.submit(_simulate_shard, artifact_path, item_codes[shard], company_codes[shard],
+                                   window[shard], daily_range) for shard in shards]
+            return np.vstack([future.result() for future in futures])
+        except Exception as e:
+            log.warning("Forecast workers failed, simulating in-process: %s", e)
+            if isinstance(e, BrokenProcessPool):
+                _reset_forecast_pool()
+            return simulate_daily(state['model'], item_codes, company_codes, window, daily_range)
+
+def _match_company(state, company):
+    """Find the trained company name matching a requested name, or None.
+
+    Names resolve through the model's company NameIndex, as quantity lookups do.
+    """
+    match = state['company_names'].match(normalize_company(company))
+    code = state['company_codes'][match] if match is not None else -1
+    return state['le_company'].classes_[code] if code >= 0 else None
+
+def _item_rows(company, unique_items, daily_preds, daily_range, frequency):
+    """Yield the (item, company, quantity, date label) rows of one item at a time"""
+    if frequency == 'Daily':
+        labels = [date.strftime('%d-%b-%Y') for date in daily_range]
+        for i, item in enumerate(unique_items):
+            yield [(item, company, qty, label) for label, qty in zip(labels, daily_preds[i])]
+    else:
+        periods = _period_groups(daily_range, frequency)
+        for i, item in enumerate(unique_items):
+            yield [(item, company, round(daily_preds[i, positions].sum(), 2), label)
+                   for label, positions in periods]
+
+def forecast_quantity(company, from_date, to_date, frequency, stream=False):
+    """
+    Forecast every item of a company; files are written separately by submit_forecast_export
+    With stream=True a generator yielding one item's rows at a time is returned instead.
+    """
     try:
         from_date = pd.to_datetime(from_date)
         to_date = pd.to_datetime(to_date)
         daily_range = pd.date_range(start=from_date, end=to_date, freq='D')
         
-        if model is None or le_item is None or le_company is None:
+        # Take one consistent model version for the whole request
+        sync_published_model()
+        state = model_state
+        if state is None:
             return "Error: Model not trained. Please upload data first."
+        trained_df = state['combined_df']
             
-        if combined_df.empty:
+        if trained_df.empty:
             return "Error: No data available for forecasting."
         
-        # Normalize company names before checking - ALSO FIX THIS LINE FOR CONSISTENCY
-        company = company.strip()
-        company = re.sub(r'\s+', ' ', company.replace('\xa0', ' '))
-
-        # Find the matching company in the encoder
-        matched_company = None
-        for cname in le_company.classes_:
-            if cname.strip() == company:
-                matched_company = cname
-                break
+        matched_company = _match_company(state, company)
 
         if matched_company is None:
             return f"Error: Company '{company}' not found in trained data."
 
         company = matched_company  # use the correct company name from trained data
 
-        unique_items = combined_df['Item'].unique()
-        item_predictions = {item: {} for item in unique_items}
-        item_results = []
-
-        # Generate daily predictions
-        for item in unique_items:
-            last_data_item = combined_df[
-                (combined_df['Item'] == item) &
-                (combined_df['Company'].str.strip() == company.strip())
-            ].sort_values('Sale Date').tail(7)
-            lag1_item = last_data_item['Qty'].iloc[-1] if not last_data_item.empty else 0
-            lag7_item = last_data_item['Qty'].iloc[-7] if len(last_data_item) >= 7 else 0
-            
-            for date in daily_range:
-                input_data = pd.DataFrame({
-                    'Item_Encoded': [le_item.transform([item])[0]],
-                    'Company_Encoded': [le_company.transform([company])[0]],
-                    'Month': [date.month],
-                    'Day': [date.day],
-                    'Year': [date.year],
-                    'DayOfWeek': [date.dayofweek],
-                    'Quarter': [date.quarter],
-                    'Lag1': [lag1_item],
-                    'Lag7': [lag7_item]
-                })
-                pred = model.predict(input_data)[0]
-                item_predictions[item][date] = round(pred, 2)
-                lag7_item = lag1_item
-                lag1_item = pred
-
-            # Process results based on frequency
-            daily_data = pd.Series(item_predictions[item]).reset_index()
-            daily_data.columns = ['Date', 'Qty']
-            daily_data['Date'] = pd.to_datetime(daily_data['Date'])
-
-            if frequency == 'Daily':
-                item_result = [(item, company, qty, date.strftime('%d-%b-%Y')) 
-                              for date, qty in item_predictions[item].items()]
-            elif frequency == 'Weekly':
-                weekly_data = daily_data.copy()
-                weekly_data['Week'] = weekly_data['Date'].dt.isocalendar().week
-                weekly_data['Year'] = weekly_data['Date'].dt.year
-                weekly_data = weekly_data.groupby(['Year', 'Week']).agg({'Qty': 'sum', 'Date': 'last'})
-                item_result = [(item, company, round(qty, 2), 
-                               f"{last_date.strftime('%d-%b-%Y')} (Week {week})")
-                              for (year, week), (qty, last_date) in weekly_data.iterrows()]
-            elif frequency == 'Monthly':
-                monthly_data = daily_data.copy()
-                monthly_data['Month'] = daily_data['Date'].dt.month
-                monthly_data['Year'] = daily_data['Date'].dt.year
-                monthly_data = monthly_data.groupby(['Year', 'Month']).agg({'Qty': 'sum', 'Date': 'last'})
-                item_result = [(item, company, round(qty, 2), 
-                               f"{last_date.strftime('%d-%b-%Y')} (Month {month})")
-                              for (year, month), (qty, last_date) in monthly_data.iterrows()]
-            else:
-                return "Error: Invalid frequency"
-            item_results.extend(item_result)
-        
-        # Save forecast result to Excel
-        df_forecast = pd.DataFrame(item_results, columns=['Item', 'Company Name', 'Forecasted Quantity', 'Date'])
-
-        # Determine filename based on frequency
-        file_map = {
-            'Daily': 'forecasting_daily.xlsx',
-            'Weekly': 'forecasting_weekly.xlsx',
-            'Monthly': 'forecasting_monthly.xlsx'
-        }
-        filename = file_map.get(frequency, 'forecasting_output.xlsx')
-        file_path = os.path.join(OUTPUT_DIR, filename)
+        if frequency not in ('Daily', 'Weekly', 'Monthly'):
+            return "Error: Invalid frequency"
 
-        # Create directory if not exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Daily predictions are cached per model version; Weekly/Monthly are aggregated from them
+        cache_key = (company, from_date, to_date, state['version'])
+        cached = _forecast_cache_get(cache_key)
+        if cached is None:
+            unique_items, daily_preds = _daily_forecast(state, company, daily_range)
+            _forecast_cache_put(cache_key, unique_items, daily_preds)
+        else:
+            unique_items, daily_preds = cached
 
-        # Save the forecast to Excel
-        try:
-            df_forecast.to_excel(file_path, index=False)
-            print(f"Forecasting result saved to {file_path}")
-        except Exception as e:
-            print(f"Error saving forecast data: {str(e)}")
+        # Process results based on frequency
+        item_rows = timed_iter('aggregation', _item_rows(company, unique_items, daily_preds, daily_range, frequency))
+        if stream:
+            return item_rows
+        item_results = [row for rows in item_rows for row in rows]
 
         return item_results
 
     except Exception as e:
-        import traceback
-        print(f"ERROR in forecast_quantity: {str(e)}")
-        print(traceback.format_exc())
-        return f"Error: {str(e)}"
\ No newline at end of file
+        log.exception("Error in forecast_quantity")
+        return f"Error: {str(e)}"
+
+def forecast_companies(companies, from_date, to_date, frequency, stream=False):
+    """
+    Forecast every item of several companies (a list of names, or 'all') at once
+    All uncached (company, item) series are simulated together by simulate_series.
+    Returns the combined rows, or with stream=True a generator of one item's rows at a time.
+    """
+    try:
+        from_date = pd.to_datetime(from_date)
+        to_date = pd.to_datetime(to_date)
+        daily_range = pd.date_range(start=from_date, end=to_date, freq='D')
+
+        # Take one consistent model version for the whole request
+        sync_published_model()
+        state = model_state
+        if state is None:
+            return "Error: Model not trained. Please upload data first."
+        trained_df, le_company = state['combined_df'], state['le_company']
+
+        if trained_df.empty:
+            return "Error: No data available for forecasting."
+
+        if frequency not in ('Daily', 'Weekly', 'Monthly'):
+            return "Error: Invalid frequency"
+
+        if isinstance(companies, str) and companies.lower() == 'all':
+            matched = list(le_company.classes_)
+        else:
+            matched = [_match_company(state, company) for company in companies]
+            missing = [company for company, match in zip(companies, matched) if match is None]
+            if missing:
+                return f"Error: Companies not found in trained data: {missing}"
+            matched = list(dict.fromkeys(matched))
+
+        # Serve what is cached; the rest is simulated as one batch of series
+        results = {}
+        pending = []
+        for company in matched:
+            cached = _forecast_cache_get((company, from_date, to_date, state['version']))
+            if cached is None:
+                pending.append(company)
+            else:
+                results[company] = cached
+
+        if pending:
+            unique_items, item_codes = state['items'], state['item_codes']
+            days, seed_day, skip = _simulation_days(state, daily_range)
+            with timed('filter'):
+                seeds = [_seed_window(state, company, seed_day) for company in pending]
+            n_items = len(unique_items)
+            daily_preds = simulate_series(
+                state,
+                np.tile(item_codes, len(pending)),
+                np.repeat(le_company.transform(pending), n_items),
+                np.concatenate(seeds),
+                days
+            )[:, skip:]
+            for i, company in enumerate(pending):
+                company_preds = daily_preds[i * n_items:(i + 1) * n_items].copy()
+                _forecast_cache_put((company, from_date, to_date, state['version']), unique_items, company_preds)
+                results[company] = (unique_items, company_preds)
+
+        log.debug("Bulk forecast for %d companies (%d simulated)", len(matched), len(pending))
+        item_rows = timed_iter('aggregation', (rows for company in matched
+                                               for rows in _item_rows(company, *results[company], daily_range, frequency)))
+        if stream:
+            return item_rows
+        return [row for rows in item_rows for row in rows]
+
+    except Exception as e:
+        log.exception("Error in forecast_companies")
+        return f"Error: {str(e)}"
+
+def submit_forecast_export(rows, frequency, export_format='xlsx'):
+    """Queue writing forecast rows to a new file in the given format and return its export id"""
+    export_format = export_format.lower()
+    if export_format not in EXPORT_FORMATS:
+        return f"Error: Invalid export format '{export_format}', must be one of {list(EXPORT_FORMATS)}"
+    if export_format == 'parquet' and not any(importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')):
+        return "Error: Parquet export requires pyarrow or fastparquet"
+    state = model_state
+    export_id = uuid.uuid4().hex
+    companies = sorted({row[1] for row in rows})
+    subject = re.sub(r'[^A-Za-z0-9]+', '_', companies[0]).strip('_') if len(companies) == 1 else 'bulk'
+    version = state['version'] if state else 0
+    filename = f"forecasting_{frequency.lower()}_{subject}_v{version}_{export_id[:12]}.{export_format}"
+    with _forecast_exports_lock:
+        # Each pending export holds its rows in memory until it is written
+        pending = sum(1 for job in forecast_exports.values() if job['finished_at'] is None)
+        if pending >= MAX_PENDING_FORECAST_EXPORTS:
+            return EXPORT_QUEUE_FULL
+        forecast_exports[export_id] = {
+            'export_id': export_id,
+            'status': 'queued',
+            'format': export_format,
+            'file_name': filename,
+            'row_count': len(rows),
+            'model_version': version,
+            'submitted_at': _now(),
+            'finished_at': None,
+            'error': None
+        }
+        _write_json(_export_status_path(export_id), forecast_exports[export_id])
+        # Forget the oldest finished exports and their files so the directory stays bounded
+        finished = [eid for eid, job in forecast_exports.items() if job['finished_at'] is not None]
+        for eid in finished[:max(0, len(forecast_exports) - MAX_FORECAST_EXPORTS)]:
+            old = forecast_exports.pop(eid)
+            stale = [_export_status_path(eid)]
+            if old['status'] == 'completed':
+                stale.append(os.path.join(EXPORT_DIR, old['file_name']))
+            for path in stale:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    _export_executor.submit(_run_forecast_export, export_id, rows)
+    return export_id
+
+def _run_forecast_export(export_id, rows):
+    job = forecast_exports[export_id]
+    try:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = os.path.join(EXPORT_DIR, job['file_name'])
+        # Keep the extension on the temporary file; writers pick their engine from it
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.tmp{ext}"
+        df_forecast = pd.DataFrame(rows, columns=['Item', 'Company Name', 'Forecasted Quantity', 'Date'])
+        with timed('excel_write' if job['format'] == 'xlsx' else 'export_write'):
+            EXPORT_FORMATS[job['format']][1](df_forecast, tmp_path)
+        os.replace(tmp_path, path)
+        job.update(status='completed', finished_at=_now())
+        log.info("Forecasting result saved to %s", path)
+    except Exception as e:
+        log.error("Error saving forecast data: %s", e)
+        job.update(status='failed', error=str(e), finished_at=_now())
+    _write_json(_export_status_path(export_id), dict(job))
+
+def _export_status_path(export_id):
+    # Status sidecar next to the export file, so any worker process can answer for it
+    return os.path.join(EXPORT_DIR, f"{export_id}.json")
+
+def get_forecast_export(export_id):
+    """Return a copy of a forecast export's status with its file path, or None for an unknown id.
+
+    Exports queued by another process are looked up from their status file in EXPORT_DIR.
+    """
+    with _forecast_exports_lock:
+        job = forecast_exports.get(export_id)
+        job = dict(job) if job else None
+    if job is None:
+        if not re.fullmatch(r'[0-9a-f]{32}', export_id):
+            return None
+        job = _read_json(_export_status_path(export_id))
+        if not isinstance(job, dict) or job.get('format') not in EXPORT_FORMATS:
+            return None
+    job['path'] = os.path.join(EXPORT_DIR, job['file_name'])
+    job['mimetype'] = EXPORT_FORMATS[job['format']][0]
+    return job
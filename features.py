@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+# Model feature order, shared by training and forecasting
+FEATURES = ['Item_Encoded', 'Company_Encoded', 'Month', 'Day', 'Year', 'DayOfWeek', 'Quarter', 'Lag1', 'Lag7']
+
+# Lag features in calendar days; forecasts carry this many past days per series
+LAGS = (1, 7)
+WINDOW = max(LAGS)
+
+# Days without sales kept for training per day with a sale; past that they are sampled and weighted up
+ZERO_SAMPLE_RATIO = 2
+
+def calendar_features(dates):
+    """Month, Day, Year, DayOfWeek and Quarter of each date as a (dates, 5) array"""
+    dates = pd.DatetimeIndex(dates)
+    return np.column_stack([dates.month, dates.day, dates.year, dates.dayofweek, dates.quarter]).astype(float)
+
+def feature_matrix(item_codes, company_codes, calendar, window, out=None):
+    """Model inputs in FEATURES order.
+
+    calendar is a (rows, 5) array from calendar_features, or one day's row
+    used for every series. window holds each series' previous WINDOW days,
+    oldest first, so its last column is Lag1 and its first is Lag7.
+    """
+    X = out if out is not None else np.empty((len(item_codes), len(FEATURES)))
+    X[:, 0] = item_codes
+    X[:, 1] = company_codes
+    X[:, 2:7] = calendar
+    X[:, 7] = window[:, -1]
+    X[:, 8] = window[:, -WINDOW]
+    return X
+
+def _series_codes(companies, items):
+    """Factorize (company, item) pairs; returns per-row series codes and the pairs' companies and items"""
+    company_codes, company_names = pd.factorize(companies)
+    item_codes, item_names = pd.factorize(items)
+    pairs = company_codes.astype(np.int64) * max(len(item_names), 1) + item_codes
+    series, unique_pairs = pd.factorize(pairs)
+    return (series, np.asarray(company_names, dtype=object)[unique_pairs // max(len(item_names), 1)],
+            np.asarray(item_names, dtype=object)[unique_pairs % max(len(item_names), 1)])
+
+class DailyPanel:
+    """Dense (series x day) array of daily sales totals, one row per (company, item) series.
+
+    Day 0 is start; days without sales are 0 and observed marks the cells that
+    had at least one sale. Lag features are read from the panel by calendar
+    day, so training sees the same Lag1/Lag7 a forecast steps through.
+    Panels are not modified once built; extend() returns a new one.
+    """
+
+    def __init__(self, companies, items, start, qty, observed):
+        self.companies = companies
+        self.items = items
+        self.start = start
+        self.qty = qty
+        self.observed = observed
+        self._series = None
+
+    @classmethod
+    def from_rows(cls, df):
+        """Build a panel from Company, Sale Date, Item, Qty rows; rows missing any of them are skipped"""
+        valid = df.dropna(subset=['Company', 'Item', 'Sale Date'])
+        if valid.empty:
+            return cls(np.array([], dtype=object), np.array([], dtype=object), None,
+                       np.zeros((0, 0), dtype=np.float32), np.zeros((0, 0), dtype=bool))
+        series, companies, items = _series_codes(valid['Company'], valid['Item'])
+        days = valid['Sale Date'].to_numpy(dtype='datetime64[D]')
+        start = days.min()
+        day = (days - start).astype(np.int64)
+        shape = (len(companies), int(day.max()) + 1)
+        cells = series * shape[1] + day
+        qty = pd.to_numeric(valid['Qty'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        totals = np.bincount(cells, weights=qty, minlength=shape[0] * shape[1])
+        observed = np.bincount(cells, minlength=shape[0] * shape[1]) > 0
+        return cls(companies, items, start, totals.astype(np.float32).reshape(shape), observed.reshape(shape))
+
+    def __len__(self):
+        return len(self.companies)
+
+    @property
+    def n_days(self):
+        return self.qty.shape[1]
+
+    def extend(self, df):
+        """New panel with more rows added, growing the series and days as needed.
+
+        Only the new rows are grouped; the existing totals are copied over.
+        """
+        valid = df.dropna(subset=['Company', 'Item', 'Sale Date'])
+        if valid.empty:
+            return self
+        if self.start is None:
+            return DailyPanel.from_rows(valid)
+        if self._series is None:
+            self._series = {key: i for i, key in enumerate(zip(self.companies, self.items))}
+        known = dict(self._series)
+        companies, items = list(self.companies), list(self.items)
+        rows = np.empty(len(valid), dtype=np.int64)
+        for i, key in enumerate(zip(valid['Company'], valid['Item'])):
+            row = known.get(key)
+            if row is None:
+                row = known[key] = len(companies)
+                companies.append(key[0])
+                items.append(key[1])
+            rows[i] = row
+        days = valid['Sale Date'].to_numpy(dtype='datetime64[D]')
+        start = min(self.start, days.min())
+        offset = int((self.start - start).astype(np.int64))
+        day = (days - start).astype(np.int64)
+        n_days = max(offset + self.n_days, int(day.max()) + 1)
+        qty = np.zeros((len(companies), n_days), dtype=np.float32)
+        observed = np.zeros((len(companies), n_days), dtype=bool)
+        qty[:len(self), offset:offset + self.n_days] = self.qty
+        observed[:len(self), offset:offset + self.n_days] = self.observed
+        np.add.at(qty, (rows, day), pd.to_numeric(valid['Qty'], errors='coerce').fillna(0).to_numpy(dtype=np.float32))
+        observed[rows, day] = True
+        panel = DailyPanel(np.array(companies, dtype=object), np.array(items, dtype=object), start, qty, observed)
+        panel._series = known
+        return panel
+
+    def lag(self, series, day, days):
+        """Totals `days` calendar days before each (series, day) cell, 0 before the panel starts"""
+        earlier = day - days
+        return np.where(earlier >= 0, self.qty[series, np.maximum(earlier, 0)], 0).astype(float)
+
+    def training_rows(self, zero_ratio=ZERO_SAMPLE_RATIO, seed=0):
+        """Panel cells in day order: (series, dates, (rows, WINDOW) lag window, daily totals, weights).
+
+        Forecasts predict every calendar day, so days without sales are
+        training rows too. When there are more than zero_ratio of them per day
+        with a sale, a seeded sample is kept and weighted so that the rows
+        stand for the whole dense panel. Only the columns at LAGS are filled
+        in the window; the rest are 0.
+        """
+        observed = self.observed.ravel()
+        sold, empty = np.flatnonzero(observed), np.flatnonzero(~observed)
+        empty_weight = 1.0
+        keep = int(zero_ratio * len(sold))
+        if 0 < keep < len(empty):
+            empty_weight = len(empty) / keep
+            empty = np.sort(np.random.default_rng(seed).choice(empty, keep, replace=False))
+        cells = np.concatenate([sold, empty])
+        weights = np.concatenate([np.ones(len(sold)), np.full(len(empty), empty_weight)])
+        series, day = np.divmod(cells, max(self.n_days, 1))
+        order = np.argsort(day, kind='stable')
+        series, day, weights = series[order], day[order], weights[order]
+        window = np.zeros((len(series), WINDOW))
+        for lag in LAGS:
+            window[:, WINDOW - lag] = self.lag(series, day, lag)
+        dates = pd.DatetimeIndex(self.start + day.astype('timedelta64[D]')) if len(day) else pd.DatetimeIndex([])
+        return series, dates, window, self.qty[series, day].astype(float), weights
+
+    def window(self, width=WINDOW, series=None, day=None):
+        """Series' `width` days before panel day `day` as floats, oldest first, 0 outside the panel.
+
+        Defaults to every series and the day after the panel ends.
+        """
+        series = np.arange(len(self)) if series is None else series
+        day = self.n_days if day is None else day
+        first = day - width
+        tail = np.zeros((len(series), width))
+        lo, hi = max(first, 0), min(day, self.n_days)
+        if hi > lo:
+            tail[:, lo - first:hi - first] = self.qty[series, lo:hi]
+        return tail
@@ -0,0 +1,79 @@
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+
+# Trees x rows walked per block in predict; small enough for the block's nodes to stay in cache
+PREDICT_BLOCK_CELLS = 1 << 18
+
+NODE_DTYPE = np.dtype([('threshold', np.float64), ('feature', np.int32), ('child', np.int32)])
+
+class FlatForest:
+    """A fitted random forest's nodes as plain arrays, predicting exactly like the forest it came from.
+
+    Every tree's nodes are laid out breadth first in one record array, with
+    each node's two children next to each other: a row goes to child, or to
+    child + 1 when its feature is above the threshold. Leaves are their own
+    child with an infinite threshold, so a row that reached one stays there.
+    Plain arrays are all it holds, so joblib.load(mmap_mode='r') maps them
+    instead of copying and processes loading the same file share one copy
+    through the page cache; sklearn copies its tree arrays when unpickling.
+    """
+
+    def __init__(self, nodes, value, roots, depth):
+        self.nodes = nodes
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+
+    @classmethod
+    def from_estimator(cls, forest):
+        """Flatten a fitted RandomForestRegressor or ExtraTreesRegressor"""
+        if not isinstance(forest, (RandomForestRegressor, ExtraTreesRegressor)):
+            raise TypeError(f"Cannot flatten a {type(forest).__name__}")
+        nodes, values, roots, depth = [], [], [], 0
+        start = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            left = tree.children_left
+            # Breadth-first order puts each node's children side by side
+            levels = [np.zeros(1, dtype=np.int64)]
+            while True:
+                internal = levels[-1][left[levels[-1]] >= 0]
+                if not len(internal):
+                    break
+                levels.append(np.column_stack([left[internal], tree.children_right[internal]]).ravel())
+            order = np.concatenate(levels)
+            position = np.empty(len(left), dtype=np.int64)
+            position[order] = np.arange(len(order)) + start
+            leaf = left[order] < 0
+            flat = np.empty(len(order), dtype=NODE_DTYPE)
+            flat['threshold'] = np.where(leaf, np.inf, tree.threshold[order])
+            flat['feature'] = np.where(leaf, 0, tree.feature[order])
+            flat['child'] = np.where(leaf, position[order], position[np.maximum(left[order], 0)])
+            nodes.append(flat)
+            values.append(tree.value[order, 0, 0].astype(np.float64))
+            roots.append(start)
+            depth = max(depth, len(levels) - 1)
+            start += len(order)
+        return cls(np.concatenate(nodes), np.concatenate(values), np.array(roots, dtype=np.int32), depth)
+
+    def __len__(self):
+        return len(self.roots)
+
+    def predict(self, X):
+        """Mean prediction of the trees for the rows of X, which must not have missing values"""
+        # sklearn rounds inputs to float32 and compares them with float64 thresholds
+        X = np.ascontiguousarray(np.asarray(X).astype(np.float32), dtype=np.float64)
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        preds = np.empty(n_rows)
+        block = max(1, PREDICT_BLOCK_CELLS // max(len(self.roots), 1))
+        for start in range(0, n_rows, block):
+            rows = np.arange(start, min(start + block, n_rows), dtype=np.int64)
+            # One row per tree and one column per input row, so a block walks one tree's nodes at a time
+            base = rows[None, :] * n_features
+            current = np.repeat(self.roots[:, None], len(rows), axis=1)
+            for _ in range(self.depth):
+                node = self.nodes[current]
+                current = node['child'] + (flat_X[base + node['feature']] > node['threshold'])
+            preds[rows] = self.value[current].sum(axis=0) / len(self.roots)
+        return preds
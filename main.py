@@ -1,24 +1,37 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, send_file, Response, stream_with_context, g
 import pandas as pd
 import os
 from datetime import datetime
 import json
-import traceback
-import sqlparse
-from data_processing import forecast_quantity, preprocess_data, get_total_quantity, load_excel_data
+import time
+import re
+import io
+import codecs
+from data_processing import forecast_quantity, forecast_companies, submit_training, get_training_status, get_total_quantity, get_total_quantities, load_excel_data, write_sales_data, export_excel_data, export_fetch_log, submit_forecast_export, get_forecast_export, EXPORT_FORMATS, EXPORT_QUEUE_FULL, parse_dates
 import csv
 import xml.etree.ElementTree as ET
+from metrics import get_logger, timed, timed_iter, begin_request, end_request, render_metrics, REQUEST_SECONDS, SLOW_REQUEST_SECONDS
 
 app = Flask(__name__)
+log = get_logger('main')
 
-# Directories
-EXCEL_DIR = r"M:\Project\Predication_model\excels"
-UPLOAD_DIR = r"M:\Project\Predication_model\upload"
+# Directories; each can be overridden through the environment
+EXCEL_DIR = os.environ.get('PREDICTION_EXCEL_DIR', r"M:\Project\Predication_model\excels")
+UPLOAD_DIR = os.environ.get('PREDICTION_UPLOAD_DIR', r"M:\Project\Predication_model\upload")
 
 # Ensure directories exist
 os.makedirs(EXCEL_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Streamed uploads (CSV, TXT, SQL) are read and stored this many rows at a time
+UPLOAD_CHUNK_ROWS = 100000
+# Bytes read from the start of a text upload to detect its format
+SNIFF_BYTES = 64 * 1024
+# Media type of streamed forecast responses
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Forecast results are only exported when the request asks for a format with ?export=
+DEFAULT_EXPORT_FORMAT = 'none'
+
 # Function to scan files for required fields
 def scan_file_for_required_fields(data_df):
     """
@@ -54,10 +67,30 @@ def scan_file_for_required_fields(data_df):
     
     return missing_fields
 
+# Request latency per endpoint; streamed responses are timed until their first byte
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    begin_request()
+
+@app.after_request
+def record_request_latency(response):
+    stages = end_request()
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    if elapsed >= SLOW_REQUEST_SECONDS:
+        breakdown = ', '.join(f"{stage}={seconds:.3f}s" for stage, seconds in sorted(stages.items(), key=lambda kv: -kv[1]))
+        log.warning("Slow request %s %s took %.3fs (%s)", request.method, request.path, elapsed, breakdown or 'no stages timed')
+    return response
+
 # Routes for the web interface
 @app.route('/')
 def index():
-    combined_df = load_excel_data()
+    combined_df = load_excel_data(columns=['Company'])
     companies = sorted(combined_df['Company'].unique().tolist()) if not combined_df.empty else []
     return render_template('index.html', companies=companies)
 
@@ -65,73 +98,363 @@ def index():
 def serve_static(filename):
     return send_from_directory('static', filename)
 
-# Function to parse XML files
-def parse_xml_to_dataframe(xml_content):
+class UploadRejected(Exception):
+    """Raised while streaming an upload to abort it with a 400 response"""
+    def __init__(self, payload):
+        super().__init__(payload.get('error') or payload.get('warning'))
+        self.payload = payload
+
+# Column names kept as text when reading delimited files, so dates are parsed by parse_dates
+TEXT_FIELDS = ['company name', 'company', 'companyname', 'company_name',
+               'sale date', 'date', 'saledate', 'sale_date', 'item']
+
+# Function to stream CSV files in chunks
+def read_csv_chunks(stream, chunk_rows=UPLOAD_CHUNK_ROWS):
+    """
+    Open a delimited upload for chunked reading without loading it into memory
+    The delimiter is sniffed from the first block; returns (chunk iterator, error)
+    """
+    sample = stream.read(SNIFF_BYTES).decode('utf-8-sig', errors='ignore')
+    stream.seek(0)
+    # Only sniff complete lines
+    if '\n' in sample:
+        sample = sample[:sample.rfind('\n')]
+    header = sample.splitlines()[0] if sample else ''
+    delimiter = None
     try:
-        root = ET.fromstring(xml_content)
-        data = []
-        
-        # Try to extract rows from common XML formats
-        rows = root.findall('.//row') or root.findall('.//item') or root.findall('.//*')
-        
-        if not rows:
-            return None, "Could not identify row elements in XML"
-        
-        # Get column names from the first row's children
-        first_row = rows[0]
-        columns = [child.tag for child in first_row]
-        
-        # If no columns were found, use attribute names
-        if not columns and first_row.attrib:
-            columns = list(first_row.attrib.keys())
-            # Extract data from attributes
-            for row in rows:
-                row_data = [row.attrib.get(col, '') for col in columns]
-                data.append(row_data)
+        delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+    except csv.Error:
+        # Try common delimiters if sniffing fails
+        for candidate in [',', ';', '\t', '|']:
+            if len(header.split(candidate)) > 1:  # Successful parsing should have multiple columns
+                delimiter = candidate
+                break
+    if delimiter is None:
+        return None, "Error parsing CSV: could not detect a delimiter"
+
+    columns = next(csv.reader([header], delimiter=delimiter), [])
+    dtypes = {col: str for col in columns if col.strip().lower() in TEXT_FIELDS}
+    log.info("Streaming delimited file with delimiter %r and columns: %s", delimiter, columns)
+
+    def chunks():
+        try:
+            for chunk in pd.read_csv(stream, sep=delimiter, chunksize=chunk_rows,
+                                     encoding='utf-8-sig', dtype=dtypes):
+                yield chunk
+        except (pd.errors.ParserError, UnicodeDecodeError, ValueError) as e:
+            raise UploadRejected({'error': f"Error parsing CSV: {str(e)}"})
+
+    return chunks(), None
+
+# Building blocks of the streaming SQL dump reader
+SQL_QUOTED = r"'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'"
+SQL_NAME = r'(?:`[^`]*`|\[[^\]]*\]|"[^"]*"|[\w$]+)'
+# Whitespace and comments between statements
+SQL_GAP = re.compile(r"(?:\s+|--[^\n]*\n|#[^\n]*\n|/\*.*?\*/)*", re.S)
+SQL_INSERT_HEAD = re.compile(
+    rf"INSERT\s+(?:IGNORE\s+)?INTO\s+({SQL_NAME}(?:\s*\.\s*{SQL_NAME})*)\s*(?:\(([^)]*)\))?\s*VALUES\s*",
+    re.I | re.S)
+# Any other statement is skipped up to its terminating semicolon. Each alternative starts
+# differently and strings can't be followed by another quote, so a statement that is
+# still incomplete fails in linear time
+SQL_OTHER_STATEMENT = re.compile(
+    rf"""(?:{SQL_QUOTED}(?!')|"[^"\\]*(?:(?:\\.|"")[^"\\]*)*"(?!")|--[^\n]*\n|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/"""
+    r"""|-(?!-)|/(?!\*)|[^;'"/-])*;""", re.S)
+# A parenthesised VALUES tuple; a run of tuples that are each followed by a comma;
+# and the last tuple of a statement with its terminator
+SQL_TUPLE = rf"\(([^'()]*(?:{SQL_QUOTED}[^'()]*)*)\)"
+SQL_VALUES_TUPLE = re.compile(SQL_TUPLE, re.S)
+SQL_VALUES_RUN = re.compile(rf"(?:\s*{SQL_TUPLE}\s*,)*", re.S)
+SQL_VALUES_LAST = re.compile(rf"\s*{SQL_TUPLE}\s*;?", re.S)
+# T-SQL N'...' (Unicode) string prefix, found outside quoted strings
+SQL_NSTRING = re.compile(rf"({SQL_QUOTED})|(?<![\w$])[Nn](?=')")
+# Unquoted NULLs and empty values are read as missing
+SQL_NULLS = ['NULL', 'null', 'Null', '']
+SQL_READ_BYTES = 1024 * 1024
+
+def _sql_identifier(name):
+    """Strip quoting from a (possibly schema-qualified) SQL identifier"""
+    return re.findall(SQL_NAME, name)[-1].strip('`"[]')
+
+def _sql_rows_to_frame(row_texts, columns):
+    """Parse buffered VALUES tuples with the C CSV parser, which also types each column in one pass"""
+    text = '\n'.join(row_texts)
+    if "N'" in text or "n'" in text:
+        text = SQL_NSTRING.sub(lambda m: m.group(1) or '', text)
+    try:
+        return pd.read_csv(io.StringIO(text), header=None, names=columns,
+                           quotechar="'", escapechar='\\', skipinitialspace=True,
+                           na_values=SQL_NULLS, keep_default_na=False)
+    except pd.errors.ParserError as e:
+        raise UploadRejected({'error': f"Error parsing SQL VALUES: {str(e)}"})
+
+# Function to stream INSERT statements out of SQL dumps
+def read_sql_chunks(stream, chunk_rows=UPLOAD_CHUNK_ROWS):
+    """
+    Yield DataFrames of up to chunk_rows rows from the INSERT statements of a SQL dump
+    The dump is scanned incrementally; the column list comes from the first INSERT and
+    only INSERTs into that table are imported. Raises UploadRejected on unusable input.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    buffer, pos, eof = '', 0, False
+    table, columns = None, None
+    in_values, skip_table = False, False
+    pending, row_count = [], 0
+
+    while True:
+        if in_values:
+            # Tuples followed by a comma are complete, so they can be taken in bulk
+            run = SQL_VALUES_RUN.match(buffer, pos)
+            if run.end() > pos:
+                if not skip_table:
+                    pending.extend(SQL_VALUES_TUPLE.findall(buffer, pos, run.end()))
+                    while len(pending) >= chunk_rows:
+                        row_count += chunk_rows
+                        yield _sql_rows_to_frame(pending[:chunk_rows], columns)
+                        pending = pending[chunk_rows:]
+                pos = run.end()
+                continue
+            match = SQL_VALUES_LAST.match(buffer, pos)
         else:
-            # Extract data from child elements
-            for row in rows:
-                row_data = [child.text for child in row]
-                data.append(row_data)
-        
-        if not data or not columns:
-            return None, "Could not extract meaningful data from XML"
-        
-        return pd.DataFrame(data, columns=columns), None
-    except Exception as e:
-        return None, f"Error parsing XML: {str(e)}"
+            gap = SQL_GAP.match(buffer, pos)
+            if gap.end() == len(buffer) and eof:
+                break
+            match = None if gap.end() == len(buffer) else (
+                SQL_INSERT_HEAD.match(buffer, gap.end()) or SQL_OTHER_STATEMENT.match(buffer, gap.end()))
+        # Only trust a match that stops short of the buffer end, unless the whole dump is read
+        if match is None or (match.end() == len(buffer) and not eof):
+            if eof:
+                if in_values:
+                    raise UploadRejected({'error': f'Malformed VALUES list in SQL file near: {buffer[pos:pos + 80]!r}'})
+                break
+            block = stream.read(SQL_READ_BYTES)
+            eof = not block
+            buffer, pos = buffer[pos:] + decoder.decode(block, final=eof), 0
+            continue
+        pos = match.end()
+
+        if in_values:
+            if not skip_table:
+                pending.append(match.group(1))
+            in_values = False
+        elif match.re is SQL_INSERT_HEAD:
+            name = _sql_identifier(match.group(1))
+            names = [_sql_identifier(col) for col in match.group(2).split(',')] if match.group(2) else None
+            if table is None:
+                if not names:
+                    raise UploadRejected({'error': 'Could not extract column names from SQL file'})
+                table, columns = name, names
+                log.info("Streaming SQL INSERT rows for table %s with columns: %s", table, columns)
+            skip_table = name != table or (names is not None and names != columns)
+            if skip_table:
+                log.info("Skipping INSERT into %s with columns %s", name, names)
+            in_values = True
+
+    if pending:
+        row_count += len(pending)
+        yield _sql_rows_to_frame(pending, columns)
+    if row_count == 0:
+        log.debug("No valid INSERT statements found in SQL file")
+        raise UploadRejected({'error': 'No valid INSERT statements found in SQL file'})
+
+# Record-like elements seen this many times under one parent mark the repeating row element
+XML_SNIFF_ROWS = 2
+# Inline schema of .NET DataSet.WriteXml(..., XmlWriteMode.WriteSchema) exports; never rows
+XML_SCHEMA_TAG = '{http://www.w3.org/2001/XMLSchema}schema'
+
+def _xml_local_name(tag):
+    """Drop the {namespace} prefix from an element or attribute name"""
+    return tag.rsplit('}', 1)[-1]
+
+def _xml_record(elem):
+    """One row from an element's attributes and child element texts"""
+    record = dict(elem.attrib)
+    record.update((child.tag, child.text) for child in elem)
+    return record
 
-# Function to parse CSV files
-def parse_csv_to_dataframe(csv_content):
+def _xml_frame(batch):
+    return pd.DataFrame(batch).rename(columns=_xml_local_name)
+
+# Function to stream rows out of XML files
+def read_xml_chunks(stream, chunk_rows=UPLOAD_CHUNK_ROWS):
+    """
+    Yield DataFrames of up to chunk_rows rows from an XML document using incremental parsing
+    The row element is the first element with children or attributes that repeats under one
+    parent, outside any inline xs:schema; rows are detached once read, so memory stays flat.
+    Raises UploadRejected on bad input.
+    """
+    path, seen, schema_depth = [], {}, 0
+    row_tag, row_depth, first_record = None, None, None
+    batch, row_count = [], 0
     try:
-        # Try to detect delimiter
-        dialect = csv.Sniffer().sniff(csv_content[:1024])
-        df = pd.read_csv(pd.StringIO(csv_content), sep=dialect.delimiter)
-        return df, None
-    except Exception as e:
-        try:
-            # Try common delimiters if sniffing fails
-            for delimiter in [',', ';', '\t', '|']:
-                try:
-                    df = pd.read_csv(pd.StringIO(csv_content), sep=delimiter)
-                    if len(df.columns) > 1:  # Successful parsing should have multiple columns
-                        return df, None
-                except:
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                path.append(elem)
+                schema_depth += elem.tag == XML_SCHEMA_TAG
+                continue
+            path.pop()
+            if schema_depth:
+                # Schema entries repeat like rows; drop the whole subtree once it is read
+                if elem.tag == XML_SCHEMA_TAG:
+                    schema_depth -= 1
+                    if not schema_depth and path:
+                        path[-1].remove(elem)
+                continue
+            if row_tag is not None:
+                if elem.tag != row_tag or len(path) != row_depth:
+                    continue
+                batch.append(_xml_record(elem))
+                path[-1].remove(elem)
+            elif not path or not (len(elem) or elem.attrib):
+                continue
+            else:
+                # Inner elements close first, so keep the shallowest candidate
+                if first_record is None or len(path) < first_record[0]:
+                    first_record = (len(path), elem)
+                parent = path[-1]
+                key = (id(parent), elem.tag)
+                seen[key] = seen.get(key, 0) + 1
+                if seen[key] < XML_SNIFF_ROWS:
                     continue
-        except:
-            pass
-        return None, f"Error parsing CSV: {str(e)}"
+                row_tag, row_depth = elem.tag, len(path)
+                log.info("Streaming XML rows from <%s> elements", _xml_local_name(row_tag))
+                # The sniffed rows are still attached to their parent, which may
+                # already hold later rows whose end events have not been seen yet
+                records = [child for child in parent if child.tag == row_tag]
+                for record in records[:records.index(elem) + 1]:
+                    batch.append(_xml_record(record))
+                    parent.remove(record)
+                seen, first_record = None, None
+            if len(batch) >= chunk_rows:
+                row_count += len(batch)
+                yield _xml_frame(batch)
+                batch = []
+    except ET.ParseError as e:
+        raise UploadRejected({'error': f"Error parsing XML: {str(e)}"})
+
+    # A document holding a single record never repeats its row element
+    if row_tag is None and first_record is not None:
+        batch = [_xml_record(first_record[1])]
+    if batch:
+        row_count += len(batch)
+        yield _xml_frame(batch)
+    if row_count == 0:
+        raise UploadRejected({'error': 'Could not extract meaningful data from XML'})
+
+def normalize_upload_frame(dotnet_df, date_formats=None):
+    """
+    Validate and normalize one uploaded frame (or chunk) to the standard columns
+    date_formats is shared by the chunks of one upload, so they all read dates the same way
+    Returns (normalized DataFrame, None) or (None, error payload for a 400 response)
+    """
+    # Normalize column names (case-insensitive)
+    dotnet_df.columns = dotnet_df.columns.str.strip()
+    log.debug("Normalized columns: %s", list(dotnet_df.columns))
+
+    # SCAN FOR REQUIRED FIELDS BEFORE PROCESSING
+    missing_fields = scan_file_for_required_fields(dotnet_df)
+    if missing_fields:
+        warning_message = f"Missing required fields: {', '.join(missing_fields)}"
+        log.debug(warning_message)
+        return None, {'warning': warning_message, 'missing_fields': missing_fields}
+
+    # Map common column names to standard names - case insensitive
+    # First, create a lowercase mapping for comparison
+    lc_mapping = {
+        'company name': 'Company',
+        'companyname': 'Company',
+        'date': 'Sale Date',
+        'saledate': 'Sale Date',
+        'quantity': 'Qty',
+        'amount': 'Qty'
+    }
+    
+    # Create a case-preserving mapping for actual columns in dataframe
+    column_mapping = {}
+    for col in dotnet_df.columns:
+        col_lower = col.lower()
+        if col_lower in lc_mapping:
+            column_mapping[col] = lc_mapping[col_lower]
+    
+    # Rename columns if they exist in the DataFrame
+    if column_mapping:
+        dotnet_df.rename(columns=column_mapping, inplace=True)
+    
+    # Standardize column names for processing
+    dotnet_df.columns = dotnet_df.columns.str.title()
+    log.debug("Final columns for processing: %s", list(dotnet_df.columns))
+
+    # Find Qty column (could be named 'Qty', 'Quantity', etc.)
+    qty_col = None
+    for possible_col in ['Qty', 'Quantity', 'Amount']:
+        if possible_col in dotnet_df.columns:
+            qty_col = possible_col
+            break
+            
+    # Validate data types for Qty
+    if qty_col:
+        qty_invalid = pd.to_numeric(dotnet_df[qty_col], errors='coerce').isnull()
+        if qty_invalid.any():
+            invalid_qty_rows = dotnet_df[qty_invalid][[qty_col]].to_dict()
+            log.debug("Non-numeric Qty values found: %s", invalid_qty_rows)
+            return None, {'error': f'Quantity column contains non-numeric values: {invalid_qty_rows}'}
+        # Convert to numeric type to ensure consistency
+        dotnet_df[qty_col] = pd.to_numeric(dotnet_df[qty_col], errors='coerce')
+    
+    # Find Date column (could be named 'Sale Date', 'Date', etc.)
+    date_col = None
+    for possible_col in ['Sale Date', 'Date', 'SaleDate']:
+        if possible_col in dotnet_df.columns:
+            date_col = possible_col
+            break
+            
+    # Validate and convert Sale Date to datetime
+    if date_col:
+        try:
+            with timed('date_parse'):
+                dotnet_df[date_col], formats = parse_dates(dotnet_df[date_col], preferred=date_formats, infer=True)
+            if formats and date_formats is not None:
+                date_formats[:] = formats + [fmt for fmt in date_formats if fmt not in formats]
+            if dotnet_df[date_col].isnull().any():
+                invalid_dates = dotnet_df[dotnet_df[date_col].isnull()][date_col].index.tolist()
+                log.debug("Invalid Date values at rows: %s", invalid_dates)
+                return None, {'error': f'Invalid Date values at rows: {invalid_dates}'}
+        except Exception as e:
+            log.debug("Error parsing date column: %s", e)
+            return None, {'error': f'Error parsing date column: {str(e)}'}
+
+    # Ensure all standard columns exist
+    required_std_columns = ['Company', 'Sale Date', 'Item', 'Qty']
+    for col in required_std_columns:
+        if col not in dotnet_df.columns:
+            if col == 'Company' and 'Company Name' in dotnet_df.columns:
+                dotnet_df.rename(columns={'Company Name': 'Company'}, inplace=True)
+            elif col == 'Sale Date' and 'Date' in dotnet_df.columns:
+                dotnet_df.rename(columns={'Date': 'Sale Date'}, inplace=True)
+            elif col == 'Qty' and 'Quantity' in dotnet_df.columns:
+                dotnet_df.rename(columns={'Quantity': 'Qty'}, inplace=True)
+            elif col == 'Item' and dotnet_df.shape[1] > 0:
+                # If Item column is missing, add a default value
+                log.debug("Adding default 'Item' column")
+                dotnet_df['Item'] = 'DefaultItem'
+
+    return dotnet_df, None
 
 # API endpoint for uploading data
 @app.route('/upload_dotnet_data', methods=['POST'])
 def upload_dotnet_data():
     try:
         dotnet_df = None
+        upload_chunks = None
+        # 'replace' overwrites the stored history, 'append' merges the new rows into it
+        mode = request.args.get('mode', 'replace').lower()
+        if mode not in ('replace', 'append'):
+            return jsonify({'error': "Invalid mode, must be 'replace' or 'append'"}), 400
         # Check if the request contains a file
         if 'file' in request.files:
             file = request.files['file']
             if file.filename == '':
-                print("DEBUG: No file selected in request")
+                log.debug("No file selected in request")
                 return jsonify({'error': 'No file selected'}), 400
             
             # Handle different file types
@@ -139,30 +462,25 @@ def upload_dotnet_data():
             
             if file_ext == '.xlsx' or file_ext == '.xls':
                 # Read Excel file
-                dotnet_df = pd.read_excel(file)
-                print(f"Loaded Excel file with columns: {list(dotnet_df.columns)}")
+                with timed('file_read'):
+                    dotnet_df = pd.read_excel(file)
+                log.info("Loaded Excel file with columns: %s", list(dotnet_df.columns))
             
             elif file_ext == '.csv':
-                # Read CSV file
-                csv_content = file.read().decode('utf-8')
-                dotnet_df, error = parse_csv_to_dataframe(csv_content)
+                # Stream CSV file in chunks
+                upload_chunks, error = read_csv_chunks(file.stream)
                 if error:
                     return jsonify({'error': error}), 400
-                print(f"Loaded CSV file with columns: {list(dotnet_df.columns)}")
             
             elif file_ext == '.xml':
-                # Read XML file
-                xml_content = file.read().decode('utf-8')
-                dotnet_df, error = parse_xml_to_dataframe(xml_content)
-                if error:
-                    return jsonify({'error': error}), 400
-                print(f"Loaded XML file with columns: {list(dotnet_df.columns)}")
+                # Stream rows out of the XML file
+                upload_chunks = read_xml_chunks(file.stream)
             
             elif file_ext == '.json':
                 # Read JSON file
-                json_content = file.read().decode('utf-8')
                 try:
-                    json_data = json.loads(json_content)
+                    with timed('file_read'):
+                        json_data = json.loads(file.read().decode('utf-8'))
                     # Handle different JSON structures
                     if isinstance(json_data, list):
                         dotnet_df = pd.DataFrame(json_data)
@@ -177,214 +495,91 @@ def upload_dotnet_data():
                         dotnet_df = pd.DataFrame([json_data])
                 except Exception as e:
                     return jsonify({'error': f'Error parsing JSON file: {str(e)}'}), 400
-                print(f"Loaded JSON file with columns: {list(dotnet_df.columns)}")
+                log.info("Loaded JSON file with columns: %s", list(dotnet_df.columns))
             
             elif file_ext == '.sql':
-                # Read SQL file content
-                sql_content = file.read().decode('utf-8')
-                print(f"Loaded SQL file content")
-                # Parse SQL content to extract table data
-                parsed = sqlparse.parse(sql_content)
-                rows = []
-                for statement in parsed:
-                    if statement.get_type() == 'INSERT':
-                        # Extract values from INSERT statements
-                        tokens = statement.tokens
-                        for token in tokens:
-                            if isinstance(token, sqlparse.sql.Values):
-                                # Extract values between parentheses
-                                values = token.get_parameters()
-                                for value_group in values:
-                                    # Clean and extract values
-                                    cleaned_values = []
-                                    for val in value_group:
-                                        if isinstance(val, sqlparse.sql.Token):
-                                            val_str = str(val).strip("'\"")
-                                            try:
-                                                # Try to convert to appropriate type
-                                                val_str = pd.to_numeric(val_str, errors='coerce')
-                                                if pd.isna(val_str):
-                                                    val_str = str(val).strip("'\"")
-                                            except:
-                                                val_str = str(val).strip("'\"")
-                                            cleaned_values.append(val_str)
-                                    rows.append(cleaned_values)
-                if not rows:
-                    print("DEBUG: No valid INSERT statements found in SQL file")
-                    return jsonify({'error': 'No valid INSERT statements found in SQL file'}), 400
-                
-                # Get column names from the first INSERT statement
-                columns = []
-                for statement in parsed:
-                    if statement.get_type() == 'INSERT':
-                        for token in statement.tokens:
-                            if isinstance(token, sqlparse.sql.Identifier):
-                                table_name = token.get_name()
-                                # Assume columns are specified in the INSERT statement
-                                for t in statement.tokens:
-                                    if isinstance(t, sqlparse.sql.Parenthesis):
-                                        cols = t.get_parameters()
-                                        columns = [col.get_name() for col in cols if col.get_name()]
-                                        break
-                        break
-                
-                if not columns:
-                    print("DEBUG: Could not extract column names from SQL file")
-                    return jsonify({'error': 'Could not extract column names from SQL file'}), 400
-                
-                # Create DataFrame from SQL data
-                dotnet_df = pd.DataFrame(rows, columns=columns)
-                print(f"Parsed SQL data into DataFrame with columns: {list(dotnet_df.columns)}")
+                # Stream INSERT rows out of the SQL dump
+                upload_chunks = read_sql_chunks(file.stream)
             
             elif file_ext == '.txt':
-                # Try to parse text file as CSV first
-                txt_content = file.read().decode('utf-8')
-                dotnet_df, error = parse_csv_to_dataframe(txt_content)
-                if error:
-                    # If CSV parsing fails, try JSON
+                # JSON text is read whole, anything else is streamed as delimited text
+                head = file.stream.read(SNIFF_BYTES).decode('utf-8-sig', errors='ignore').lstrip()
+                file.stream.seek(0)
+                if head.startswith('[') or head.startswith('{'):
                     try:
-                        json_data = json.loads(txt_content)
+                        json_data = json.loads(file.read().decode('utf-8-sig'))
                         if isinstance(json_data, list):
                             dotnet_df = pd.DataFrame(json_data)
                         else:
                             dotnet_df = pd.DataFrame([json_data])
-                    except:
+                    except Exception:
+                        return jsonify({'error': 'Could not parse text file as CSV or JSON'}), 400
+                    log.info("Parsed text file with columns: %s", list(dotnet_df.columns))
+                else:
+                    upload_chunks, error = read_csv_chunks(file.stream)
+                    if error:
                         return jsonify({'error': 'Could not parse text file as CSV or JSON'}), 400
-                print(f"Parsed text file with columns: {list(dotnet_df.columns)}")
             
             else:
-                print(f"DEBUG: Unsupported file extension: {file_ext}")
+                log.debug("Unsupported file extension: %s", file_ext)
                 return jsonify({'error': 'Unsupported file format. Please upload .xlsx, .xls, .csv, .json, .xml, .sql, or .txt files'}), 400
         
         # Check if the request contains JSON data (.NET or JSON input)
         elif request.is_json:
             data = request.get_json()
             if not data:
-                print("DEBUG: No JSON data provided")
+                log.debug("No JSON data provided")
                 return jsonify({'error': 'No JSON data provided'}), 400
             dotnet_df = pd.DataFrame(data if isinstance(data, list) else [data])
-            print(f"Loaded JSON data with columns: {list(dotnet_df.columns)}")
+            log.info("Loaded JSON data with columns: %s", list(dotnet_df.columns))
         
         else:
             form_data = request.form
             if form_data:
-                print(f"Received form data: {form_data}")
                 try:
                     # Try to parse form data as JSON
                     json_data = json.loads(next(iter(form_data)))
                     dotnet_df = pd.DataFrame(json_data if isinstance(json_data, list) else [json_data])
-                    print(f"Parsed form data into DataFrame with columns: {list(dotnet_df.columns)}")
+                    log.info("Parsed form data into DataFrame with columns: %s", list(dotnet_df.columns))
                 except Exception as e:
-                    print(f"DEBUG: Error parsing form data: {str(e)}")
+                    log.debug("Error parsing form data: %s", e)
                     return jsonify({'error': f'Invalid form data: {str(e)}'}), 400
             else:
-                print("DEBUG: Invalid input, no JSON or file provided")
+                log.debug("Invalid input, no JSON or file provided")
                 return jsonify({'error': 'Invalid input: Provide JSON data, an Excel file, or a SQL file'}), 400
 
-        # Normalize column names (case-insensitive)
-        dotnet_df.columns = dotnet_df.columns.str.strip()
-        print(f"Normalized columns: {list(dotnet_df.columns)}")
-
-        # SCAN FOR REQUIRED FIELDS BEFORE PROCESSING
-        missing_fields = scan_file_for_required_fields(dotnet_df)
-        if missing_fields:
-            warning_message = f"Missing required fields: {', '.join(missing_fields)}"
-            print(f"DEBUG: {warning_message}")
-            return jsonify({'warning': warning_message, 'missing_fields': missing_fields}), 400
-
-        # Map common column names to standard names - case insensitive
-        # First, create a lowercase mapping for comparison
-        lc_mapping = {
-            'company name': 'Company',
-            'companyname': 'Company',
-            'date': 'Sale Date',
-            'saledate': 'Sale Date',
-            'quantity': 'Qty',
-            'amount': 'Qty'
-        }
-        
-        # Create a case-preserving mapping for actual columns in dataframe
-        column_mapping = {}
-        for col in dotnet_df.columns:
-            col_lower = col.lower()
-            if col_lower in lc_mapping:
-                column_mapping[col] = lc_mapping[col_lower]
-        
-        # Rename columns if they exist in the DataFrame
-        if column_mapping:
-            dotnet_df.rename(columns=column_mapping, inplace=True)
-        
-        # Standardize column names for processing
-        dotnet_df.columns = dotnet_df.columns.str.title()
-        print(f"Final columns for processing: {list(dotnet_df.columns)}")
-
-        # Find Qty column (could be named 'Qty', 'Quantity', etc.)
-        qty_col = None
-        for possible_col in ['Qty', 'Quantity', 'Amount']:
-            if possible_col in dotnet_df.columns:
-                qty_col = possible_col
-                break
-                
-        # Validate data types for Qty
-        if qty_col:
-            qty_invalid = pd.to_numeric(dotnet_df[qty_col], errors='coerce').isnull()
-            if qty_invalid.any():
-                invalid_qty_rows = dotnet_df[qty_invalid][[qty_col]].to_dict()
-                print(f"DEBUG: Non-numeric Qty values found: {invalid_qty_rows}")
-                return jsonify({'error': f'Quantity column contains non-numeric values: {invalid_qty_rows}'}), 400
-            # Convert to numeric type to ensure consistency
-            dotnet_df[qty_col] = pd.to_numeric(dotnet_df[qty_col], errors='coerce')
-        
-        # Find Date column (could be named 'Sale Date', 'Date', etc.)
-        date_col = None
-        for possible_col in ['Sale Date', 'Date', 'SaleDate']:
-            if possible_col in dotnet_df.columns:
-                date_col = possible_col
-                break
-                
-        # Validate and convert Sale Date to datetime
-        if date_col:
-            try:
-                dotnet_df[date_col] = pd.to_datetime(dotnet_df[date_col], errors='coerce')
-                if dotnet_df[date_col].isnull().any():
-                    invalid_dates = dotnet_df[dotnet_df[date_col].isnull()][date_col].index.tolist()
-                    print(f"DEBUG: Invalid Date values at rows: {invalid_dates}")
-                    return jsonify({'error': f'Invalid Date values at rows: {invalid_dates}'}), 400
-                # Convert to DD-MM-YYYY string format for storage
-                dotnet_df[date_col] = dotnet_df[date_col].dt.strftime('%d-%m-%Y')
-                print(f"DEBUG: {date_col} successfully converted to DD-MM-YYYY")
-            except Exception as e:
-                print(f"DEBUG: Error parsing date column: {str(e)}")
-                return jsonify({'error': f'Error parsing date column: {str(e)}'}), 400
-
-        # Ensure all standard columns exist
-        required_std_columns = ['Company', 'Sale Date', 'Item', 'Qty']
-        for col in required_std_columns:
-            if col not in dotnet_df.columns:
-                if col == 'Company' and 'Company Name' in dotnet_df.columns:
-                    dotnet_df.rename(columns={'Company Name': 'Company'}, inplace=True)
-                elif col == 'Sale Date' and 'Date' in dotnet_df.columns:
-                    dotnet_df.rename(columns={'Date': 'Sale Date'}, inplace=True)
-                elif col == 'Qty' and 'Quantity' in dotnet_df.columns:
-                    dotnet_df.rename(columns={'Quantity': 'Qty'}, inplace=True)
-                elif col == 'Item' and dotnet_df.shape[1] > 0:
-                    # If Item column is missing, add a default value
-                    print(f"WARNING: Adding default 'Item' column")
-                    dotnet_df['Item'] = 'DefaultItem'
-        
-        # Save the DataFrame to Uploaded Data.xlsx, overwriting existing file
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        excel_path = os.path.join(UPLOAD_DIR, "Uploaded Data.xlsx")
-        dotnet_df.to_excel(excel_path, index=False)
-        print(f"Data saved to {excel_path}")
+        if upload_chunks is None:
+            upload_chunks = [dotnet_df]
+        else:
+            # Streamed formats are read as their chunks are pulled
+            upload_chunks = timed_iter('file_read', upload_chunks)
+
+        def normalized_chunks():
+            date_formats = []
+            for chunk in upload_chunks:
+                chunk, error = normalize_upload_frame(chunk, date_formats)
+                if error:
+                    raise UploadRejected(error)
+                yield chunk
+
+        # Save the upload to the sales store chunk by chunk; a rejected chunk discards the whole upload
+        try:
+            row_count = write_sales_data(normalized_chunks(), mode)
+        except UploadRejected as e:
+            return jsonify(e.payload), 400
 
-        # Trigger preprocessing of the new data
-        preprocess_data()
+        # Train on the new data in the background; the current model keeps serving until then
+        job_id = submit_training()
 
-        return jsonify({'message': 'Data uploaded and processed successfully', 'row_count': len(dotnet_df)}), 200
+        return jsonify({
+            'message': 'Data uploaded successfully, model training started',
+            'row_count': row_count,
+            'mode': mode,
+            'job_id': job_id,
+            'status_url': f'/training_status/{job_id}'
+        }), 202
     except Exception as e:
-        print(f"Exception in /upload_dotnet_data:")
-        print(traceback.format_exc())
+        log.exception("Exception in /upload_dotnet_data")
         return jsonify({'error': f"An error occurred while processing the data: {str(e)}"}), 500
 
 @app.route('/get_quantity', methods=['POST', 'GET'])
@@ -421,16 +616,16 @@ def api_get_quantity():
                                 from_date = json_data.get('from_date')
                                 to_date = json_data.get('to_date')
                         except Exception as e:
-                            print(f"Error parsing form data as JSON: {str(e)}")
+                            log.debug("Error parsing form data as JSON: %s", e)
             except Exception as e:
-                print(f"Error extracting data from request: {str(e)}")
+                log.debug("Error extracting data from request: %s", e)
                 return jsonify({'error': f'Could not parse request data: {str(e)}'}), 400
             
         # Validate inputs
         if not company or not from_date or not to_date:
             return jsonify({'error': 'Missing required parameters (company, from_date, to_date)'}), 400
         
-        print(f"Processing get_quantity request: company={company}, from_date={from_date}, to_date={to_date}")
+        log.debug("Processing get_quantity request: company=%s, from_date=%s, to_date=%s", company, from_date, to_date)
         
         # Call get_total_quantity function to process data and save to Excel
         total_quantity = get_total_quantity(company, from_date, to_date)
@@ -442,10 +637,80 @@ def api_get_quantity():
         return jsonify({'total_quantity': int(total_quantity)})
             
     except Exception as e:
-        print("Exception in /get_quantity:")
-        print(traceback.format_exc())
+        log.exception("Exception in /get_quantity")
+        return jsonify({'error': f"Error processing quantity request: {str(e)}"}), 500
+
+@app.route('/get_quantity_batch', methods=['POST'])
+def api_get_quantity_batch():
+    try:
+        data = request.get_json(silent=True)
+        # Accept either {"queries": [...]} or a bare list of queries
+        queries = data.get('queries') if isinstance(data, dict) else data
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'error': 'Provide a JSON list of {company, from_date, to_date} queries'}), 400
+
+        log.debug("Processing get_quantity batch request with %d queries", len(queries))
+
+        results = get_total_quantities(queries)
+
+        # Check if an error was returned
+        if isinstance(results, str) and results.startswith("Error:"):
+            return jsonify({'error': results}), 500
+
+        return jsonify({'results': results})
+
+    except Exception as e:
+        log.exception("Exception in /get_quantity_batch")
         return jsonify({'error': f"Error processing quantity request: {str(e)}"}), 500
 
+def requested_export_format():
+    """Export format named by ?export= or the JSON body's "export", lowercased"""
+    data = request.get_json(silent=True) if request.is_json else None
+    export_format = request.args.get('export') or (data.get('export') if isinstance(data, dict) else None)
+    return (export_format or DEFAULT_EXPORT_FORMAT).lower()
+
+def queue_export(predictions, frequency, export_format):
+    """Queue the forecast file export; returns (export info for the response, (error response, status))"""
+    if export_format == 'none':
+        return None, None
+    export_id = submit_forecast_export(predictions, frequency, export_format)
+    if export_id == EXPORT_QUEUE_FULL:
+        return None, (jsonify({'error': export_id}), 503)
+    if export_id.startswith("Error:"):
+        return None, (jsonify({'error': export_id}), 400)
+    return {
+        'export_id': export_id,
+        'status_url': f'/forecast_exports/{export_id}',
+        'download_url': f'/forecast_exports/{export_id}/download'
+    }, None
+
+def wants_ndjson():
+    """Whether the client asked for a streamed response (stream=1 or Accept: application/x-ndjson)"""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return NDJSON_MIMETYPE in request.headers.get('Accept', '')
+
+def prediction_record(pred):
+    """Forecast row tuple as returned to the web interface"""
+    return {
+        'Item': pred[0],
+        'Company Name': pred[1],
+        'Forecasted Quantity': float(pred[2]),  # Ensure JSON-serializable
+        'Date': pred[3]
+    }
+
+def ndjson_response(row_batches):
+    """Stream batches of forecast rows as newline-delimited JSON, one chunk per batch"""
+    def generate():
+        try:
+            for rows in row_batches:
+                yield ''.join(json.dumps(prediction_record(pred)) + '\n' for pred in rows)
+        except Exception as e:
+            # Headers are already sent, so report the failure as the last line
+            log.exception("Error while streaming forecast rows")
+            yield json.dumps({'error': f"Error forecasting data: {str(e)}"}) + '\n'
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
 @app.route('/forecast', methods=['POST', 'GET'])
 def api_forecast():
     try:
@@ -482,7 +747,7 @@ def api_forecast():
                             to_date = json_data.get('to_date')
                             frequency = json_data.get('frequency')
                     except Exception as e:
-                        print(f"Error parsing form data as JSON: {str(e)}")
+                        log.debug("Error parsing form data as JSON: %s", e)
         
         # Validate inputs
         if not all([company, from_date, to_date, frequency]):
@@ -493,41 +758,147 @@ def api_forecast():
         if frequency not in ['Daily', 'Weekly', 'Monthly']:
             return jsonify({'error': 'Invalid frequency, must be Daily, Weekly, or Monthly'}), 400
         
-        print(f"Processing forecast request: company={company}, from_date={from_date}, to_date={to_date}, frequency={frequency}")
+        log.debug("Processing forecast request: company=%s, from_date=%s, to_date=%s, frequency=%s", company, from_date, to_date, frequency)
         
+        export_format = requested_export_format()
+        if export_format != 'none' and export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"Invalid export format, must be one of {list(EXPORT_FORMATS)} or 'none'"}), 400
+
         # Call forecast function
-        predictions = forecast_quantity(company, from_date, to_date, frequency)
+        stream = wants_ndjson()
+        predictions = forecast_quantity(company, from_date, to_date, frequency, stream=stream)
         
         # Check if an error was returned
         if isinstance(predictions, str) and predictions.startswith("Error:"):
             return jsonify({'error': predictions}), 500
+
+        if stream:
+            return ndjson_response(predictions)
         
         # Format response to match web interface
-        result = [
-            {
-                'Item': pred[0],
-                'Company Name': pred[1],
-                'Forecasted Quantity': float(pred[2]),  # Ensure JSON-serializable
-                'Date': pred[3]
-            }
-            for pred in predictions
-        ]
+        result = [prediction_record(pred) for pred in predictions]
+
+        # The file is written in the background, so it does not add to the response time
+        export, error = queue_export(predictions, frequency, export_format)
+        if error:
+            return error
         
-        return jsonify({'predictions': result})
+        return jsonify({'predictions': result, 'export': export})
         
     except Exception as e:
-        print("Exception in /forecast:")
-        print(traceback.format_exc())
+        log.exception("Exception in /forecast")
+        return jsonify({'error': f"Error forecasting data: {str(e)}"}), 500
+
+@app.route('/forecast_bulk', methods=['POST'])
+def api_forecast_bulk():
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'Provide a JSON body with companies, from_date, to_date and frequency'}), 400
+        companies = data.get('companies', 'all')
+        from_date = data.get('from_date')
+        to_date = data.get('to_date')
+        frequency = data.get('frequency')
+
+        # Validate inputs
+        if not all([companies, from_date, to_date, frequency]):
+            return jsonify({'error': 'Missing required parameters'}), 400
+        if isinstance(companies, str) and companies.lower() != 'all':
+            companies = [companies]
+        if not isinstance(companies, (list, str)) or not all(isinstance(c, str) for c in companies):
+            return jsonify({'error': "companies must be a list of company names or 'all'"}), 400
+
+        frequency = frequency.lower().capitalize()
+        if frequency not in ['Daily', 'Weekly', 'Monthly']:
+            return jsonify({'error': 'Invalid frequency, must be Daily, Weekly, or Monthly'}), 400
+
+        log.debug("Processing bulk forecast request: companies=%s, from_date=%s, to_date=%s, frequency=%s", companies, from_date, to_date, frequency)
+
+        export_format = requested_export_format()
+        if export_format != 'none' and export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"Invalid export format, must be one of {list(EXPORT_FORMATS)} or 'none'"}), 400
+
+        stream = wants_ndjson()
+        predictions = forecast_companies(companies, from_date, to_date, frequency, stream=stream)
+
+        if isinstance(predictions, str) and predictions.startswith("Error:"):
+            return jsonify({'error': predictions}), 500
+
+        if stream:
+            return ndjson_response(predictions)
+
+        export, error = queue_export(predictions, frequency, export_format)
+        if error:
+            return error
+
+        return jsonify({'predictions': [prediction_record(pred) for pred in predictions], 'export': export})
+
+    except Exception as e:
+        log.exception("Exception in /forecast_bulk")
         return jsonify({'error': f"Error forecasting data: {str(e)}"}), 500
 
 @app.route('/get_companies', methods=['GET'])
 def get_companies():
     try:
-        combined_df = load_excel_data()
+        combined_df = load_excel_data(columns=['Company'])
         companies = sorted(combined_df['Company'].unique().tolist()) if not combined_df.empty else []
         return jsonify({'companies': companies})
     except Exception as e:
         return jsonify({'error': f"Error retrieving companies: {str(e)}"}), 500
 
+@app.route('/training_status/<job_id>', methods=['GET'])
+def training_status(job_id):
+    status = get_training_status(job_id)
+    if status is None:
+        return jsonify({'error': f"Unknown training job '{job_id}'"}), 404
+    return jsonify(status)
+
+@app.route('/forecast_exports/<export_id>', methods=['GET'])
+def forecast_export_status(export_id):
+    export = get_forecast_export(export_id)
+    if export is None:
+        return jsonify({'error': f"Unknown export id '{export_id}'"}), 404
+    export.pop('path')
+    export.pop('mimetype')
+    export['download_url'] = f'/forecast_exports/{export_id}/download'
+    return jsonify(export)
+
+@app.route('/forecast_exports/<export_id>/download', methods=['GET'])
+def download_forecast_export(export_id):
+    export = get_forecast_export(export_id)
+    if export is None:
+        return jsonify({'error': f"Unknown export id '{export_id}'"}), 404
+    if export['status'] != 'completed':
+        return jsonify({'error': f"Export is {export['status']}", 'status': export['status'], 'details': export['error']}), 409
+    if not os.path.exists(export['path']):
+        return jsonify({'error': 'Export file no longer exists'}), 410
+    return send_file(os.path.abspath(export['path']), mimetype=export['mimetype'],
+                     as_attachment=True, download_name=export['file_name'])
+
+@app.route('/export_data', methods=['GET'])
+def export_data():
+    try:
+        # Excel is only an export format; build it from the store on demand
+        file_path = export_excel_data(os.path.join(EXCEL_DIR, 'Uploaded Data.xlsx'))
+        return send_file(os.path.abspath(file_path), as_attachment=True)
+    except Exception as e:
+        log.exception("Exception in /export_data")
+        return jsonify({'error': f"Error exporting data: {str(e)}"}), 500
+
+@app.route('/export_fetched_data', methods=['GET'])
+def export_fetched_data():
+    try:
+        # The quantity log is appended to as CSV; the workbook is only built when asked for
+        file_path = export_fetch_log()
+        return send_file(os.path.abspath(file_path), as_attachment=True)
+    except Exception as e:
+        log.exception("Exception in /export_fetched_data")
+        return jsonify({'error': f"Error exporting fetched data: {str(e)}"}), 500
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Stage timings and per-endpoint latency histograms for Prometheus to scrape
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,135 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Log level for the whole app; per-request detail is logged at DEBUG and is off by default
+LOG_LEVEL = os.environ.get('PREDICTION_LOG_LEVEL', 'INFO').upper()
+
+# Requests slower than this are logged with the time spent in each stage
+SLOW_REQUEST_SECONDS = float(os.environ.get('PREDICTION_SLOW_REQUEST_SECONDS', '2.0'))
+
+# Histogram buckets in seconds, from cache hits up to full trainings
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_root_logger = logging.getLogger('salespredict')
+if not _root_logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+    _root_logger.addHandler(_handler)
+    _root_logger.setLevel(LOG_LEVEL)
+    _root_logger.propagate = False
+
+def get_logger(name):
+    """Logger for one module of the app, sharing the app's handler and level"""
+    return logging.getLogger(f'salespredict.{name}')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+class Histogram:
+    """Prometheus-style histogram with a fixed set of label names"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                labels = _format_labels(self.labelnames, key, [('le', repr(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{labels} {values[-1]}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {values[-2]}')
+            lines.append(f'{self.name}_count{labels} {values[-1]}')
+        return '\n'.join(lines)
+
+REGISTRY = []
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Create a histogram and register it for /metrics"""
+    metric = Histogram(name, documentation, labelnames, buckets)
+    REGISTRY.append(metric)
+    return metric
+
+STAGE_SECONDS = histogram('salespredict_stage_seconds', 'Time spent in each processing stage.', ['stage'])
+REQUEST_SECONDS = histogram('salespredict_request_seconds', 'HTTP request latency by endpoint.',
+                            ['endpoint', 'method', 'status'])
+
+# Stage totals of the request being handled on this thread
+_request_stages = threading.local()
+
+def begin_request():
+    """Start collecting stage times for the request handled on this thread"""
+    _request_stages.stages = {}
+
+def end_request():
+    """Stop collecting and return {stage: seconds} for the request handled on this thread"""
+    stages = getattr(_request_stages, 'stages', None) or {}
+    _request_stages.stages = None
+    return stages
+
+def observe_stage(stage, seconds):
+    """Record time spent in a stage, also against the current request if one is being timed"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = getattr(_request_stages, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage):
+    """Time the enclosed block as one stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def timed_iter(stage, iterable):
+    """Yield from an iterable, timing the work of producing each item as a stage"""
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            yield item
+    finally:
+        observe_stage(stage, total)
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
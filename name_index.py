@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+import numpy as np
+
+# Fuzzy lookups remembered per index before the memo is cleared
+MAX_FUZZY_MEMO = 10000
+
+def _trigrams(name):
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+class NameIndex:
+    """Normalized names mapped to ids, with a trigram index for substring matches.
+
+    Ids are positions in the name list, so earlier names win ties. match() is
+    an exact dictionary lookup, falling back to the first name that contains
+    the query or is contained in it. Candidates for that fallback come from the
+    trigram postings instead of a scan over every name.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.ids = {}
+        for i, name in enumerate(self.names):
+            self.ids.setdefault(name, i)
+        postings = defaultdict(list)
+        # Names too short to have a trigram are checked directly
+        self._short = []
+        self._gram_counts = np.zeros(len(self.names), dtype=np.int64)
+        for i, name in enumerate(self.names):
+            grams = _trigrams(name)
+            self._gram_counts[i] = len(grams)
+            if not grams:
+                self._short.append(i)
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, name):
+        """Id of an exact name, or None"""
+        return self.ids.get(name)
+
+    def match(self, name):
+        """Id of the exact name, else of the first name containing it or contained in it, or None"""
+        exact = self.ids.get(name)
+        if exact is not None:
+            return exact
+        if name in self._memo:
+            return self._memo[name]
+        if len(self._memo) >= MAX_FUZZY_MEMO:
+            self._memo.clear()
+        found = self._fuzzy(name)
+        self._memo[name] = found
+        return found
+
+    def _fuzzy(self, name):
+        grams = _trigrams(name)
+        candidates = []
+        # Names containing the query hold every one of its trigrams
+        if grams:
+            lists = sorted((self._postings.get(gram) for gram in grams), key=lambda ids: 0 if ids is None else len(ids))
+            if lists[0] is not None:
+                containing = lists[0]
+                for ids in lists[1:]:
+                    containing = np.intersect1d(containing, ids, assume_unique=True)
+                    if len(containing) == 0:
+                        break
+                candidates.extend(int(i) for i in containing if name in self.names[i])
+        elif self.names:
+            # A query shorter than a trigram can only be checked directly
+            candidates.extend(i for i, other in enumerate(self.names) if name in other)
+        # Names contained in the query have all of their trigrams in it
+        present = [self._postings[gram] for gram in grams if gram in self._postings]
+        if present:
+            hits = np.bincount(np.concatenate(present), minlength=len(self.names))
+            contained = np.flatnonzero((hits == self._gram_counts) & (self._gram_counts > 0))
+            candidates.extend(int(i) for i in contained if self.names[i] in name)
+        candidates.extend(i for i in self._short if self.names[i] in name)
+        return min(candidates) if candidates else None
@@ -0,0 +1,51 @@
+from collections.abc import Mapping
+
+class DataSnapshot(Mapping):
+    """Immutable, versioned bundle of the state one request works against.
+
+    Fields are read as snapshot['name'] or snapshot.name and can't be changed
+    after construction; replace() returns a new snapshot instead. Writers build
+    a complete snapshot and publish it with a single reference assignment, so a
+    request that takes the current snapshot once sees one consistent version
+    for its whole duration, without locking. The frames and arrays it holds are
+    shared between requests and must not be modified in place either.
+    """
+
+    __slots__ = ('_fields',)
+
+    def __init__(self, **fields):
+        object.__setattr__(self, '_fields', fields)
+
+    def __getitem__(self, name):
+        return self._fields[name]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getattr__(self, name):
+        try:
+            return self._fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"DataSnapshot is immutable, use replace() to change '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError("DataSnapshot is immutable")
+
+    def __reduce__(self):
+        return (_restore, (self._fields,))
+
+    def __repr__(self):
+        return f"DataSnapshot(version={self._fields.get('version')!r}, fields={list(self._fields)})"
+
+    def replace(self, **changes):
+        """New snapshot with some fields changed"""
+        return DataSnapshot(**dict(self._fields, **changes))
+
+def _restore(fields):
+    return DataSnapshot(**fields)
@@ -0,0 +1,255 @@
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Columns every stored sales frame has, mapped to their storage columns
+CORE_COLUMNS = {
+    'Company': 'company_id',
+    'Sale Date': 'sale_date',
+    'Item': 'item_id',
+    'Qty': 'qty'
+}
+
+# Extra upload columns are stored under this prefix, since SQLite column names are
+# case-insensitive and an upload's Id or Qty column would otherwise clash with the core columns
+EXTRA_PREFIX = 'x_'
+
+# Dictionary tables holding the distinct Company and Item names
+DICTIONARY_TABLES = {
+    'Company': 'companies',
+    'Item': 'items'
+}
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+def _to_days(value):
+    """Convert a date-like value to an integer day number"""
+    return int((np.datetime64(pd.Timestamp(value), 'D') - EPOCH).astype(np.int64))
+
+class SqliteSalesStore:
+    """Sales history stored in SQLite.
+
+    Company and Item are dictionary-encoded into integer ids, Sale Date is
+    stored as an integer day number and an index on (company_id, sale_date)
+    lets company and date filters be answered inside SQLite. Any extra upload
+    columns (Price, State, ...) are kept as plain columns next to them, named
+    with EXTRA_PREFIX.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        # Autocommit mode; writes open explicit transactions so DDL is rolled back too
+        return sqlite3.connect(self.path, isolation_level=None, timeout=30)
+
+    @contextmanager
+    def _transaction(self):
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def exists(self):
+        """Whether a sales table has been written yet"""
+        if not os.path.exists(self.path):
+            return False
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sales'").fetchone()
+        return row is not None
+
+    def version(self):
+        """Cheap token that changes whenever the stored data changes"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def columns(self):
+        """Frame column names available in the store"""
+        with closing(self._connect()) as conn:
+            return list(self._column_map(conn))
+
+    def _column_map(self, conn):
+        """Frame column names mapped to their storage columns, in table order"""
+        reverse = {v: k for k, v in CORE_COLUMNS.items()}
+        mapping = {}
+        for row in conn.execute('PRAGMA table_info(sales)'):
+            stored = row[1]
+            if stored == 'id':
+                continue
+            if stored in reverse:
+                mapping[reverse[stored]] = stored
+            else:
+                # Stores written before EXTRA_PREFIX keep their unprefixed extra columns
+                mapping[stored[len(EXTRA_PREFIX):] if stored.startswith(EXTRA_PREFIX) else stored] = stored
+        return mapping
+
+    def _dictionary(self, conn, column):
+        """Names of a dictionary table as an array indexed by id"""
+        rows = conn.execute(f'SELECT name FROM {DICTIONARY_TABLES[column]} ORDER BY id').fetchall()
+        return np.array([row[0] for row in rows], dtype=object)
+
+    def _encode(self, conn, df):
+        """Translate a cleaned frame into its storage columns, extending dictionaries as needed"""
+        df = df.reset_index(drop=True)
+        frame = pd.DataFrame(index=df.index)
+        for column, table in DICTIONARY_TABLES.items():
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+            known = {name: i for i, name in enumerate(self._dictionary(conn, column))}
+            values = df[column].astype(object)
+            present = values.notna()
+            new_names = [name for name in pd.unique(values[present].astype(str)) if name not in known]
+            conn.executemany(f'INSERT INTO {table} (id, name) VALUES (?, ?)',
+                             [(len(known) + i, name) for i, name in enumerate(new_names)])
+            known.update({name: len(known) + i for i, name in enumerate(new_names)})
+            frame[CORE_COLUMNS[column]] = values[present].astype(str).map(known).reindex(df.index).astype('Int64')
+        dates = pd.to_datetime(df['Sale Date'])
+        days = pd.Series((dates.to_numpy(dtype='datetime64[D]') - EPOCH).astype(np.int64), index=df.index)
+        frame['sale_date'] = days.where(dates.notna()).astype('Int64')
+        frame['qty'] = df['Qty']
+        stored = self._column_map(conn)
+        for column in df.columns:
+            if column not in CORE_COLUMNS:
+                frame[stored.get(column, f'{EXTRA_PREFIX}{column}')] = df[column]
+        return frame
+
+    def _prepare_table(self, conn, frame):
+        """Create the sales table and its indexes, adding any new extra columns"""
+        conn.execute('CREATE TABLE IF NOT EXISTS sales ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, company_id INTEGER, sale_date INTEGER, '
+                     'item_id INTEGER, qty NUMERIC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_sales_company_date ON sales (company_id, sale_date)')
+        # Dedupe key: re-inserting an existing (Company, Sale Date, Item, Qty) replaces that row
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_sales_key ON sales (company_id, sale_date, item_id, qty)')
+        existing = {row[1].lower() for row in conn.execute('PRAGMA table_info(sales)')}
+        for column in frame.columns:
+            if column.lower() not in existing:
+                conn.execute(f'ALTER TABLE sales ADD COLUMN "{column}"')
+
+    def _insert(self, conn, frame):
+        """Insert encoded rows, replacing stored rows with the same dedupe key"""
+        frame = frame.copy()
+        for column in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[column]):
+                frame[column] = frame[column].astype(str)
+        frame = frame.astype(object)
+        frame = frame.where(frame.notna(), None)
+        names = ', '.join(f'"{column}"' for column in frame.columns)
+        marks = ', '.join('?' for _ in frame.columns)
+        conn.executemany(f'INSERT OR REPLACE INTO sales ({names}) VALUES ({marks})',
+                         frame.itertuples(index=False, name=None))
+
+    @contextmanager
+    def writer(self, mode='replace'):
+        """Write cleaned frames in a single transaction.
+
+        mode 'replace' drops the stored history first, 'append' merges into it.
+        Yields a SalesWriter whose write(df) can be called once per chunk;
+        readers see nothing until the block exits without an error.
+        """
+        with self._transaction() as conn:
+            if mode == 'replace':
+                for table in ['sales'] + list(DICTIONARY_TABLES.values()):
+                    conn.execute(f'DROP TABLE IF EXISTS {table}')
+            self._prepare_table(conn, pd.DataFrame())
+            start_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM sales').fetchone()[0]
+            yield SalesWriter(self, conn, start_id)
+
+    def replace(self, df):
+        """Overwrite the stored history with a cleaned frame"""
+        with self.writer('replace') as writer:
+            writer.write(df)
+
+    def append(self, df):
+        """Merge a cleaned frame into the stored history.
+
+        Rows whose (Company, Sale Date, Item, Qty) key is already stored replace
+        the stored row, so only the new rows are checked against the unique key
+        index. Returns the appended rows as they now read back from the store.
+        """
+        with self.writer('append') as writer:
+            writer.write(df)
+        return self.read(after_id=writer.start_id)
+
+    def read(self, columns=None, company=None, from_date=None, to_date=None, after_id=None):
+        """Read stored rows in insertion order.
+
+        columns limits which frame columns are read, company (an exact stored
+        name) and the inclusive from_date/to_date bounds are evaluated in SQL.
+        after_id restricts the read to rows written after that row id.
+        Company and Item come back as categoricals over the whole dictionary,
+        so their categories may include names absent from the rows read.
+        """
+        where, params = [], []
+        if company is not None:
+            where.append('company_id IN (SELECT id FROM companies WHERE name = ?)')
+            params.append(company)
+        if from_date is not None:
+            where.append('sale_date >= ?')
+            params.append(_to_days(from_date))
+        if to_date is not None:
+            where.append('sale_date <= ?')
+            params.append(_to_days(to_date))
+        if after_id is not None:
+            where.append('id > ?')
+            params.append(after_id)
+        with closing(self._connect()) as conn:
+            stored = self._column_map(conn)
+            columns = list(columns) if columns is not None else list(stored)
+            select = [f'"{stored.get(col, CORE_COLUMNS.get(col, EXTRA_PREFIX + col))}"' for col in columns]
+            query = f"SELECT {', '.join(select)} FROM sales"
+            if where:
+                query += ' WHERE ' + ' AND '.join(where)
+            query += ' ORDER BY id'
+            raw = pd.read_sql_query(query, conn, params=params)
+            raw.columns = columns
+            for column in DICTIONARY_TABLES:
+                if column in columns:
+                    # Dictionary ids are the category codes; names are never materialized per row
+                    names = self._dictionary(conn, column)
+                    codes = raw[column].fillna(-1).astype(np.int64).to_numpy()
+                    raw[column] = pd.Categorical.from_codes(codes, categories=pd.Index(names, dtype=object))
+        if 'Sale Date' in columns:
+            raw['Sale Date'] = pd.to_datetime(raw['Sale Date'], unit='D')
+        return raw
+
+    def companies(self):
+        """Distinct stored company names"""
+        with closing(self._connect()) as conn:
+            return self._dictionary(conn, 'Company').tolist()
+
+class SalesWriter:
+    """Chunk writer handed out by SqliteSalesStore.writer"""
+
+    def __init__(self, store, conn, start_id):
+        self.store = store
+        self.conn = conn
+        # Rows written by this writer read back with store.read(after_id=start_id)
+        self.start_id = start_id
+        self.row_count = 0
+
+    def write(self, df):
+        frame = self.store._encode(self.conn, df)
+        self.store._prepare_table(self.conn, frame)
+        self.store._insert(self.conn, frame)
+        self.row_count += len(frame)
+
+# Available storage backends, selected by name in data_processing.STORE_BACKEND
+STORAGE_BACKENDS = {
+    'sqlite': SqliteSalesStore
+}
+
+def open_store(backend, path):
+    """Create the storage backend registered under the given name"""
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}'. Available: {list(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[backend](path)
@@ -0,0 +1,17 @@
+"""Trainer process for multi-worker serving.
+
+Retrains whenever the stored sales history changes and publishes the model
+and a snapshot of the data it serves from into the model directory. Run one
+next to any number of web workers started with PREDICTION_SERVING_MODE=worker:
+
+    python trainer.py
+    PREDICTION_SERVING_MODE=worker gunicorn -w 4 main:app
+"""
+import os
+
+os.environ['PREDICTION_SERVING_MODE'] = 'trainer'
+
+import data_processing
+
+if __name__ == '__main__':
+    data_processing.run_trainer()